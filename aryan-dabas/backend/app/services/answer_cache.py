@@ -0,0 +1,124 @@
+"""In-memory semantic cache of LLM answers for repeated questions"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from . import lexical
+except ImportError:
+    import lexical
+
+# Words that do not change what a question is about; every other term must match
+STOPWORDS = frozenset("""
+a an the and or of in on at to for from by with about as is are was were be been being do does did
+have has had can could would should will what which who whom whose when where why how much many
+me my i you your tell list show give please any all some this that these those there it its s
+""".split())
+
+
+def _env_number(name, default, cast):
+    try:
+        return cast(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def normalize_question(question):
+    """Normalize case and whitespace so trivially different questions match"""
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def key_terms(question):
+    """Content words of a question, without stopwords and plural "s" """
+    return frozenset(
+        term[:-1] if len(term) > 3 and term.endswith("s") and not term.endswith("ss") else term
+        for term in lexical.tokenize(question) if term not in STOPWORDS
+    )
+
+
+class AnswerCache:
+    """LRU + TTL cache of answers matched exactly or by embedding similarity.
+
+    A similar question only matches if it also has the same key terms, so
+    "What are Alice's skills?" never gets the answer cached for Bob. Entries
+    are scoped (for example by persist directory and retrieval
+    settings) and tagged with the index version they were computed against;
+    a lookup with a newer index version drops the stale entries of that scope.
+    """
+
+    def __init__(self, max_entries=256, ttl_seconds=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # (scope, normalized question) -> entry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, scope, index_version):
+        now = time.monotonic()
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if now - entry["created"] > self.ttl_seconds:
+                del self._entries[key]
+            elif key[0] == scope and entry["index_version"] != index_version:
+                del self._entries[key]
+
+    def get(self, scope, question, embedding, index_version):
+        """Return a cached answer for the question, or None"""
+        with self._lock:
+            self._expire(scope, index_version)
+
+            key = (scope, normalize_question(question))
+            if key not in self._entries and embedding is not None:
+                key = self._nearest(scope, embedding, key_terms(question))
+
+            if key is None or key not in self._entries:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]["answer"]
+
+    def _nearest(self, scope, embedding, terms):
+        keys = [key for key, entry in self._entries.items() if key[0] == scope and entry["terms"] == terms]
+        if not keys:
+            return None
+        # Embeddings are normalized, so the dot product is the cosine similarity
+        matrix = np.asarray([self._entries[key]["embedding"] for key in keys], dtype=np.float32)
+        scores = matrix @ np.asarray(embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity_threshold else None
+
+    def put(self, scope, question, embedding, index_version, answer):
+        """Store an answer, evicting the least recently used entry when full"""
+        with self._lock:
+            key = (scope, normalize_question(question))
+            self._entries[key] = {
+                "embedding": embedding,
+                "terms": key_terms(question),
+                "answer": answer,
+                "index_version": index_version,
+                "created": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+answer_cache = AnswerCache(
+    max_entries=_env_number("ANSWER_CACHE_SIZE", 256, int),
+    ttl_seconds=_env_number("ANSWER_CACHE_TTL", 3600, float),
+    similarity_threshold=_env_number("ANSWER_CACHE_THRESHOLD", 0.95, float),
+)
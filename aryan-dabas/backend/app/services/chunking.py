@@ -0,0 +1,142 @@
+"""Structure-aware chunking: split documents at page and section boundaries.
+
+Extracted text is cut into segments wherever a page ends (from the
+``<name>.pages.json`` offsets written by ingest) or a section heading starts
+(Skills, Experience, Education, ...). Each segment is split on its own, so
+a chunk never mixes two sections or two pages, and every chunk carries
+``source``, ``page``, ``section``, ``start_index`` and ``end_index``
+metadata that can be used in Chroma ``where`` filters.
+"""
+import re
+
+# Canonical section name -> headings that start it (matched case-insensitively)
+SECTION_HEADINGS = {
+    "summary": ["summary", "professional summary", "profile", "about me", "objective", "career objective"],
+    "skills": ["skills", "technical skills", "key skills", "core skills", "core competencies", "competencies",
+               "technologies", "tools", "tech stack", "skills and tools", "soft skills"],
+    "experience": ["experience", "work experience", "professional experience", "employment",
+                   "employment history", "work history", "career history", "internships", "internship"],
+    "education": ["education", "academic background", "qualifications", "academic qualifications"],
+    "projects": ["projects", "personal projects", "key projects", "academic projects"],
+    "certifications": ["certifications", "certificates", "licenses", "licenses and certifications", "courses"],
+    "awards": ["awards", "achievements", "honors", "honours", "accomplishments"],
+    "publications": ["publications", "research"],
+    "languages": ["languages"],
+    "interests": ["interests", "hobbies"],
+    "volunteering": ["volunteering", "volunteer experience", "extracurricular activities"],
+    "contact": ["contact", "contact information", "personal details"],
+    "references": ["references"],
+}
+
+# Text before the first heading (name, contact line, ...)
+DEFAULT_SECTION = "header"
+
+_HEADING_TO_SECTION = {
+    heading: section for section, headings in SECTION_HEADINGS.items() for heading in headings
+}
+# A heading ends the line or is followed by a colon or a spaced dash, so words
+# like "Objective-C" or "Research-driven" do not start a section
+_KNOWN_HEADING_RE = re.compile(
+    r"^[\s#*\-•>|]*(" + "|".join(
+        re.escape(h).replace(r"\ ", r"\s+") for h in sorted(_HEADING_TO_SECTION, key=len, reverse=True)
+    ) + r")(?:\s*:|\s+[-–—]\s|\s*$)",
+    re.IGNORECASE,
+)
+# Short all-caps lines such as "TOOLS & PLATFORMS" are headings when one of
+# their words is a known heading; other caps lines (often the name) are not
+_CAPS_HEADING_RE = re.compile(r"^[\s#*\-•]*([A-Z][A-Z&/ ]{2,40}?)\s*:?\s*$")
+
+
+def _canonical(heading):
+    return _HEADING_TO_SECTION.get(" ".join(heading.lower().split()))
+
+
+def detect_sections(text):
+    """Return ``[(offset, section)]`` for every section heading in ``text``"""
+    sections = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and len(stripped) <= 80:
+            match = _KNOWN_HEADING_RE.match(line)
+            section = _canonical(match.group(1)) if match else None
+            if section is None and len(stripped.split()) <= 4:
+                caps = _CAPS_HEADING_RE.match(line)
+                if caps:
+                    words = re.findall(r"[a-z]+", caps.group(1).lower())
+                    section = _canonical(" ".join(words)) or next(
+                        (_HEADING_TO_SECTION[w] for w in words if w in _HEADING_TO_SECTION), None)
+            if section is not None and (not sections or sections[-1][1] != section):
+                sections.append((offset + len(line) - len(line.lstrip()), section))
+        offset += len(line)
+    return sections
+
+
+def segments(text, page_offsets=None):
+    """Cut ``text`` into ``(start, end, page, section)`` pieces at page and section boundaries.
+
+    ``page`` is 1-based, or None when no page offsets are known.
+    """
+    if page_offsets:
+        pages = [(start, end, number) for number, (start, end) in enumerate(page_offsets, 1) if end > start]
+    else:
+        pages = [(0, len(text), None)]
+
+    boundaries = [(0, DEFAULT_SECTION)] + detect_sections(text)
+    result = []
+    for page_start, page_end, page in pages:
+        for i, (section_start, section) in enumerate(boundaries):
+            section_end = boundaries[i + 1][0] if i + 1 < len(boundaries) else len(text)
+            start, end = max(page_start, section_start), min(page_end, section_end)
+            if end > start and text[start:end].strip():
+                result.append((start, end, page, section))
+    return result
+
+
+def split_document(doc, splitter):
+    """Split one document into chunks that respect page and section boundaries.
+
+    Page offsets are read from ``doc.metadata["pages"]`` when present (see
+    ``embed.load_texts``); that list is not copied into the chunks.
+    """
+    from langchain_core.documents import Document
+
+    text = doc.page_content
+    base = {key: value for key, value in doc.metadata.items() if key != "pages"}
+    chunks = []
+    for start, end, page, section in segments(text, doc.metadata.get("pages")):
+        piece = text[start:end]
+        search_from = 0
+        for part in splitter.split_text(piece):
+            # The splitter strips whitespace, so locate each part in its segment
+            offset = piece.find(part, search_from)
+            if offset < 0:
+                offset = search_from
+            search_from = offset + 1
+            if not part.strip():
+                continue
+            metadata = dict(base, section=section, start_index=start + offset, end_index=start + offset + len(part))
+            if page is not None:
+                metadata["page"] = page
+            chunks.append(Document(page_content=part, metadata=metadata))
+    return chunks
+
+
+def split_documents(docs, splitter):
+    return [chunk for doc in docs for chunk in split_document(doc, splitter)]
+
+
+def test_detect_sections():
+    """Check heading detection on inputs that used to be split wrongly"""
+    cases = [
+        ("SKILLS\nSwift, Kotlin\nObjective-C, C++\nDocker, AWS\nEXPERIENCE", [(0, "skills"), (50, "experience")]),
+        ("Research-driven engineer with 5 years of ML work\nEducation: MSc", [(49, "education")]),
+        ("Skills - Python, Go\nWork Experience —\nAcme", [(0, "skills"), (20, "experience")]),
+    ]
+    for text, expected in cases:
+        found = detect_sections(text)
+        print("✓" if found == expected else "✗", repr(text[:30]), found)
+
+
+if __name__ == "__main__":
+    test_detect_sections()
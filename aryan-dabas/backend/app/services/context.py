@@ -0,0 +1,136 @@
+"""Assemble retrieved chunks into a compact, token-budgeted LLM context"""
+import hashlib
+import re
+
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about four characters per token for English)"""
+    return len(text) // 4 + 1
+
+
+def simhash(text, shingle=3):
+    """64-bit SimHash over word shingles; near-duplicate texts differ in few bits"""
+    words = WORD_RE.findall(text.lower())
+    shingles = [" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    weights = [0] * 64
+    for item in shingles:
+        value = int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def merge_adjacent(docs):
+    """Merge overlapping or touching chunks from the same source into one block.
+
+    Relies on the ``start_index`` metadata added by the splitter; chunks
+    without it are kept as they are. The merged block keeps the position of
+    its best-ranked chunk.
+    """
+    from langchain_core.documents import Document
+
+    blocks = []  # [rank, source, start, end, text, doc]
+    for rank, doc in enumerate(docs):
+        start = doc.metadata.get("start_index")
+        blocks.append([rank, doc.metadata.get("source"), start,
+                       None if start is None else start + len(doc.page_content), doc.page_content, doc])
+
+    positioned = sorted((b for b in blocks if b[2] is not None), key=lambda b: (b[1], b[2]))
+    merged = [b for b in blocks if b[2] is None]
+    for block in positioned:
+        last = merged[-1] if merged and merged[-1][2] is not None else None
+        if last is not None and last[1] == block[1] and block[2] <= last[3]:
+            # Append only the part of the next chunk that is not already covered
+            overlap = last[3] - block[2]
+            if block[3] > last[3]:
+                last[4] += block[4][overlap:]
+                last[3] = block[3]
+            last[0] = min(last[0], block[0])
+        else:
+            merged.append(block)
+
+    merged.sort(key=lambda b: b[0])
+    result = []
+    for rank, source, start, end, text, doc in merged:
+        metadata = dict(doc.metadata)
+        if start is not None:
+            metadata.update(start_index=start, end_index=end)
+        result.append(Document(page_content=text, metadata=metadata))
+    return result
+
+
+def drop_near_duplicates(docs, max_distance=3):
+    """Drop chunks whose SimHash is within ``max_distance`` bits of a better-ranked chunk"""
+    kept, fingerprints = [], []
+    for doc in docs:
+        fingerprint = simhash(doc.page_content)
+        if any(_hamming(fingerprint, other) <= max_distance for other in fingerprints):
+            continue
+        kept.append(doc)
+        fingerprints.append(fingerprint)
+    return kept
+
+
+def mmr_order(query_embedding, doc_embeddings, lambda_mult=0.7):
+    """Order documents by maximal marginal relevance (relevance vs. diversity)"""
+    query = np.asarray(query_embedding, dtype=np.float32)
+    vectors = np.asarray(doc_embeddings, dtype=np.float32)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    selected, remaining = [], list(range(len(vectors)))
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        selected.append(remaining.pop(int(np.argmax(scores))))
+    return selected
+
+
+def pack(docs, budget_tokens):
+    """Keep the best-ranked documents that fit within the token budget"""
+    packed, used = [], 0
+    for doc in docs:
+        tokens = estimate_tokens(doc.page_content)
+        if used + tokens > budget_tokens:
+            continue
+        packed.append(doc)
+        used += tokens
+    if not packed and docs:
+        # Never send an empty context: truncate the best chunk to the budget
+        from langchain_core.documents import Document
+        first = docs[0]
+        text = first.page_content[:budget_tokens * 4]
+        packed, used = [Document(page_content=text, metadata=first.metadata)], estimate_tokens(text)
+    return packed, used
+
+
+def assemble_context(docs, budget_tokens=1000, query_embedding=None, embeddings=None,
+                     mmr_lambda=None, max_distance=3):
+    """Build the LLM context from ranked chunks.
+
+    Adjacent chunks of the same source are merged, near-duplicates dropped,
+    the rest optionally reordered by MMR (needs ``query_embedding`` and an
+    ``embeddings`` model) and packed into ``budget_tokens``.
+    Returns ``(docs, context_text)``.
+    """
+    before = sum(estimate_tokens(doc.page_content) for doc in docs)
+    blocks = drop_near_duplicates(merge_adjacent(docs), max_distance=max_distance)
+
+    if mmr_lambda is not None and query_embedding is not None and embeddings is not None and len(blocks) > 1:
+        vectors = embeddings.embed_documents([doc.page_content for doc in blocks])
+        blocks = [blocks[i] for i in mmr_order(query_embedding, vectors, mmr_lambda)]
+
+    packed, used = pack(blocks, budget_tokens)
+    print(f"🧩 Context: {len(docs)} chunks -> {len(packed)} blocks, ~{before} -> ~{used} tokens")
+    return packed, "\n\n".join(doc.page_content for doc in packed)
@@ -1,39 +1,30 @@
-# Updated imports to fix deprecation warnings
-from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
+import hashlib
+import json
 import os
+import shutil
 
-# Use the correct, non-deprecated import
 try:
-    from langchain_huggingface import HuggingFaceEmbeddings
-    print("Using langchain_huggingface.HuggingFaceEmbeddings")
+    from . import chunking, ingest, lexical, metrics, store
 except ImportError:
-    try:
-        from langchain_community.embeddings import HuggingFaceEmbeddings
-        print("Using langchain_community.embeddings.HuggingFaceEmbeddings")
-    except ImportError:
-        print("Error: Could not import HuggingFaceEmbeddings. Please install langchain-huggingface or langchain-community")
-        raise
-
-# Initialize the BGE embeddings model with error handling
-try:
-    bge_model = HuggingFaceEmbeddings(
-        model_name="BAAI/bge-small-en",
-        model_kwargs={"device": "cpu"},
-        encode_kwargs={"normalize_embeddings": True}  # important for cosine similarity
-    )
-    print("✓ BGE embeddings model initialized successfully")
-except Exception as e:
-    print(f"❌ Error initializing embeddings model: {e}")
-    print("This might be due to missing dependencies. Try:")
-    print("pip install sentence-transformers")
-    raise
+    import chunking
+    import ingest
+    import lexical
+    import metrics
+    import store
 
-embeddings = bge_model
+def __getattr__(name):
+    # The embeddings model is loaded lazily by the shared store
+    if name in ("embeddings", "bge_model"):
+        return store.get_embeddings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_texts(text_dir):
-    """Load text files from directory and return as Document objects"""
+    """Load text files from directory and return as Document objects.
+
+    The page offsets recorded by ingest are attached as ``metadata["pages"]``
+    so chunks can be tagged with their page.
+    """
+    from langchain_core.documents import Document
     docs = []
     
     if not os.path.exists(text_dir):
@@ -47,10 +38,11 @@ def load_texts(text_dir):
                 with open(filepath, "r", encoding="utf-8") as f:
                     content = f.read().strip()
                     if content:
-                        docs.append(Document(
-                            page_content=content, 
-                            metadata={"source": filename}
-                        ))
+                        metadata = {"source": filename}
+                        pages = ingest.load_page_offsets(text_dir, filename[:-len(".txt")])
+                        if pages and max(end for _, end in pages) <= len(content):
+                            metadata["pages"] = pages
+                        docs.append(Document(page_content=content, metadata=metadata))
                         print(f"✓ Loaded document: {filename} ({len(content)} chars)")
             except Exception as e:
                 print(f"❌ Error reading file {filename}: {e}")
@@ -58,67 +50,244 @@ def load_texts(text_dir):
     print(f"✓ Loaded {len(docs)} documents from {text_dir}")
     return docs
 
-def embed_documents(docs, persist_dir="data/chroma_store"):
-    """Create embeddings for documents and store in ChromaDB"""
+COLLECTION_NAME = store.COLLECTION_NAME
+
+# Bump whenever the splitter settings change so existing indexes get rebuilt
+CHUNKER_VERSION = "sections-500-50-v4"
+MANIFEST_VERSION = 1
+
+# Chroma rejects very large upserts, so new chunks are written in batches
+ADD_BATCH_SIZE = 1024
+
+metrics.describe("rag_chunks_total", "Chunks added to or deleted from the vector store")
+
+def get_text_splitter():
+    """Create the text splitter used within each page/section segment (see chunking.py)"""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(
+        chunk_size=500, 
+        chunk_overlap=50,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=True  # lets the query side merge adjacent chunks
+    )
+
+def _hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _chunk_hash(chunk):
+    """Hash a chunk's text together with its metadata"""
+    meta = json.dumps(chunk.metadata, sort_keys=True, default=str)
+    return _hash_text(f"{chunk.page_content}\0{meta}")
+
+manifest_path = store.manifest_path
+
+def _empty_manifest():
+    return {
+        "version": MANIFEST_VERSION,
+        "collection": COLLECTION_NAME,
+        "chunker": CHUNKER_VERSION,
+        "index_version": 0,
+        "files": {},
+    }
+
+def load_manifest(persist_dir="data/chroma_store"):
+    """Load the index manifest, returning None if missing or unreadable"""
+    path = manifest_path(persist_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ Could not read index manifest {path}: {e}")
+        return None
+
+def save_manifest(manifest, persist_dir="data/chroma_store"):
+    """Atomically write the index manifest"""
+    path = manifest_path(persist_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _manifest_is_compatible(manifest):
+    return (
+        manifest is not None
+        and manifest.get("version") == MANIFEST_VERSION
+        and manifest.get("collection") == COLLECTION_NAME
+        and manifest.get("chunker") == CHUNKER_VERSION
+    )
+
+def _file_hash(doc):
+    """Hash a document's text together with its page offsets"""
+    return _hash_text(f"{doc.page_content}\0{json.dumps(doc.metadata.get('pages'))}")
+
+def _split_document(splitter, doc):
+    """Split one document at page/section boundaries and return {chunk_id: (chunk_hash, chunk)}"""
+    source = doc.metadata.get("source", "")
+    chunks = chunking.split_document(doc, splitter)
+
+    result = {}
+    seen = {}
+    for chunk in chunks:
+        chunk_hash = _chunk_hash(chunk)
+        # Identical chunks within one file still need distinct ids
+        occurrence = seen.get(chunk_hash, 0)
+        seen[chunk_hash] = occurrence + 1
+        chunk_id = f"{source}::{chunk_hash[:16]}"
+        if occurrence:
+            chunk_id = f"{chunk_id}::{occurrence}"
+        result[chunk_id] = (chunk_hash, chunk)
+    return result
+
+def _clear_persist_dir(persist_dir):
+    # Release cached clients before their files disappear
+    store.invalidate(persist_dir, reset=True)
+    try:
+        if os.path.exists(persist_dir):
+            shutil.rmtree(persist_dir)
+            print("🗑️ Cleared existing vector store")
+    except Exception as e:
+        print(f"⚠️ Could not clear existing vector store: {e}")
+    os.makedirs(persist_dir, exist_ok=True)
+
+def _load_lexical_index(db, persist_dir):
+    """Load the BM25 index, rebuilding it from the collection if it is missing"""
+    bm25 = lexical.load_index(persist_dir)
+    if bm25 is not None:
+        return bm25
+
+    print("🔄 Building BM25 index from existing collection...")
+    bm25 = lexical.BM25Index()
+    results = db._collection.get(include=["documents", "metadatas"])
+    for chunk_id, text, metadata in zip(
+        results.get("ids", []),
+        results.get("documents", []),
+        results.get("metadatas", [])
+    ):
+        bm25.add(chunk_id, text or "", metadata)
+    return bm25
+
+def embed_documents(docs, persist_dir="data/chroma_store", rebuild=False):
+    """Incrementally sync document embeddings into ChromaDB.
+
+    Only chunks of new or changed files are embedded; chunks of files that are
+    no longer in ``docs`` are deleted. The BM25 index used for hybrid search
+    is updated with the same changes. A full rebuild happens when ``rebuild``
+    is set or the manifest is missing or was written by another chunker.
+    """
     if not docs:
         print("❌ No documents to embed")
         return None
+    if store.is_snapshot(persist_dir):
+        print(f"❌ {persist_dir} is a read-only index snapshot; ingest into the source store and re-export")
+        return None
     
     try:
-        # Create text splitter
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=500, 
-            chunk_overlap=50,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        # Split documents into chunks
-        print("🔄 Splitting documents into chunks...")
-        chunks = splitter.split_documents(docs)
-        
-        # Filter out empty chunks
-        chunks = [c for c in chunks if c.page_content.strip()]
+        splitter = get_text_splitter()
+
+        manifest = load_manifest(persist_dir)
+        rebuild = rebuild or not _manifest_is_compatible(manifest) or not os.path.exists(persist_dir)
+        if rebuild:
+            print("🔄 Rebuilding vector store from scratch...")
+            # Keep counting up so caches never mistake the new index for the old one
+            version = (manifest or {}).get("index_version", 0) + 1
+            # Before wiping, leave an incompatible manifest and no BM25 index, so a
+            # rebuild that fails midway is retried instead of trusting the old file list
+            pending = _empty_manifest()
+            pending.update(chunker=None, index_version=version)
+            save_manifest(pending, persist_dir)
+            if os.path.exists(lexical.index_path(persist_dir)):
+                os.remove(lexical.index_path(persist_dir))
+            _clear_persist_dir(persist_dir)
+            manifest = _empty_manifest()
+            manifest["index_version"] = version
         
-        if not chunks:
+        db = store.get_vectorstore(persist_dir)
+        bm25 = lexical.BM25Index() if rebuild else _load_lexical_index(db, persist_dir)
+
+        old_files = manifest["files"]
+        new_files = {}
+        add_ids, add_chunks, delete_ids = [], [], []
+        unchanged = 0
+
+        print("🔄 Checking documents for changes...")
+        for doc in docs:
+            source = doc.metadata.get("source", "")
+            file_hash = _file_hash(doc)
+            previous = old_files.get(source)
+
+            if previous and previous.get("hash") == file_hash:
+                new_files[source] = previous
+                unchanged += 1
+                continue
+
+            with metrics.span("embed.split"):
+                chunks = _split_document(splitter, doc)
+            old_chunks = previous.get("chunks", {}) if previous else {}
+
+            for chunk_id, (_, chunk) in chunks.items():
+                if chunk_id not in old_chunks:
+                    add_ids.append(chunk_id)
+                    add_chunks.append(chunk)
+            delete_ids.extend(cid for cid in old_chunks if cid not in chunks)
+
+            new_files[source] = {
+                "hash": file_hash,
+                "chunks": {cid: chunk_hash for cid, (chunk_hash, _) in chunks.items()},
+            }
+
+        removed = [source for source in old_files if source not in new_files]
+        for source in removed:
+            delete_ids.extend(old_files[source].get("chunks", {}))
+
+        print(f"✓ {unchanged} unchanged, {len(docs) - unchanged} new/changed, {len(removed)} removed files")
+
+        if delete_ids:
+            with metrics.span("embed.delete") as span:
+                span["chunks"] = len(delete_ids)
+                db.delete(ids=delete_ids)
+            for chunk_id in delete_ids:
+                bm25.remove(chunk_id)
+            print(f"🗑️ Deleted {len(delete_ids)} stale chunks")
+
+        if add_chunks:
+            print(f"📄 Sample chunk: {add_chunks[0].page_content[:200]}...")
+            print(f"🔄 Embedding {len(add_chunks)} new chunks...")
+            # Includes embedding the chunks; the model itself is timed as embed.model
+            with metrics.span("embed.add") as span:
+                span["chunks"] = len(add_chunks)
+                for i in range(0, len(add_chunks), ADD_BATCH_SIZE):
+                    db.add_documents(
+                        add_chunks[i:i + ADD_BATCH_SIZE],
+                        ids=add_ids[i:i + ADD_BATCH_SIZE]
+                    )
+            for chunk_id, chunk in zip(add_ids, add_chunks):
+                bm25.add(chunk_id, chunk.page_content, chunk.metadata)
+
+        metrics.inc("rag_chunks_total", len(add_ids), op="added")
+        metrics.inc("rag_chunks_total", len(delete_ids), op="deleted")
+        changed = bool(add_ids or delete_ids or removed)
+        if changed:
+            manifest["index_version"] = manifest.get("index_version", 0) + 1
+        if changed or not os.path.exists(lexical.index_path(persist_dir)):
+            lexical.save_index(bm25, persist_dir)
+        manifest["files"] = new_files
+        save_manifest(manifest, persist_dir)
+        # Readers reopen the store against the new index version
+        store.invalidate(persist_dir)
+
+        total = sum(len(f["chunks"]) for f in new_files.values())
+        if total == 0:
             print("❌ No valid chunks created from documents")
             return None
-        
-        print(f"✓ Created {len(chunks)} chunks from {len(docs)} documents")
-        
-        # Show sample chunk for debugging
-        if chunks:
-            print(f"📄 Sample chunk: {chunks[0].page_content[:200]}...")
-        
-        # Ensure the persist directory exists
-        os.makedirs(persist_dir, exist_ok=True)
-        
-        # Clear existing collection if it exists to avoid conflicts
-        try:
-            if os.path.exists(persist_dir):
-                import shutil
-                shutil.rmtree(persist_dir)
-                os.makedirs(persist_dir, exist_ok=True)
-                print("🗑️ Cleared existing vector store")
-        except Exception as e:
-            print(f"⚠️ Could not clear existing vector store: {e}")
-        
-        print("🔄 Creating vector store...")
-        # Create ChromaDB vector store
-        db = Chroma.from_documents(
-            chunks, 
-            embedding=embeddings, 
-            persist_directory=persist_dir,
-            collection_name="document_embeddings"
-        )
-        
-        # Verify the vector store was created successfully
+
         try:
-            test_results = db.similarity_search("test", k=1)
-            print(f"✅ Successfully created vector store with {len(chunks)} chunks")
-            print(f"✓ Vector store verification: {len(test_results)} results found")
+            count = db._collection.count()
+            print(f"✅ Vector store in sync: {count} chunks ({len(add_ids)} added, {len(delete_ids)} deleted)")
         except Exception as e:
-            print(f"⚠️ Vector store created but verification failed: {e}")
+            print(f"⚠️ Vector store updated but verification failed: {e}")
         
         return db
         
@@ -135,11 +304,7 @@ def load_existing_vectorstore(persist_dir="data/chroma_store"):
             print(f"📁 Vector store directory {persist_dir} does not exist")
             return None
         
-        db = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings,
-            collection_name="document_embeddings"
-        )
+        db = store.get_vectorstore(persist_dir)
         
         # Test if the vector store has documents
         try:
@@ -155,10 +320,9 @@ def load_existing_vectorstore(persist_dir="data/chroma_store"):
         return None
 
 def get_or_create_vectorstore(text_dir="data/text_outputs", persist_dir="data/chroma_store"):
-    """Get existing vector store or create new one from text files"""
+    """Get the vector store, syncing it incrementally with the text files"""
     
-    # Always create new vector store for reliability
-    print("🔄 Creating fresh vector store...")
+    print("🔄 Syncing vector store with text files...")
     docs = load_texts(text_dir)
     if docs:
         db = embed_documents(docs, persist_dir)
@@ -170,7 +334,7 @@ def get_or_create_vectorstore(text_dir="data/text_outputs", persist_dir="data/ch
 # For backward compatibility
 def create_embeddings():
     """Create and return embeddings instance"""
-    return embeddings
+    return store.get_embeddings()
 
 if __name__ == "__main__":
     # Test the embedding functionality
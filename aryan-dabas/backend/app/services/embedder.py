@@ -0,0 +1,115 @@
+"""Batched BGE embedding backend with optional ONNX Runtime / int8 inference"""
+import os
+
+from langchain_core.embeddings import Embeddings
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Where exported ONNX models are cached between runs
+ONNX_CACHE_DIR = "data/models"
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class BGEEmbeddings(Embeddings):
+    """SentenceTransformer embeddings with explicit, length-sorted batching.
+
+    Texts are sorted by length before batching so each batch pads to similar
+    lengths, then results are put back in input order. The vectors match
+    ``HuggingFaceEmbeddings(..., encode_kwargs={"normalize_embeddings": True})``
+    for the same model, so existing collections stay compatible.
+    """
+
+    def __init__(self, model_name="BAAI/bge-small-en", backend="torch", batch_size=64,
+                 num_threads=0, normalize=True, quantization="avx512_vnni"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.normalize = normalize
+        self.quantization = quantization
+        self.model = self._load_model()
+
+    @classmethod
+    def from_env(cls, model_name="BAAI/bge-small-en"):
+        """Build from EMBED_BACKEND, EMBED_BATCH_SIZE, EMBED_THREADS and EMBED_ONNX_QUANT"""
+        return cls(
+            model_name=model_name,
+            backend=os.environ.get("EMBED_BACKEND", "torch"),
+            batch_size=_env_int("EMBED_BATCH_SIZE", 64),
+            num_threads=_env_int("EMBED_THREADS", 0),
+            quantization=os.environ.get("EMBED_ONNX_QUANT", "avx512_vnni"),
+        )
+
+    def _load_model(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("Error: sentence-transformers is required. Try: pip install sentence-transformers")
+            raise
+
+        if self.backend == "torch":
+            if self.num_threads > 0:
+                import torch
+                torch.set_num_threads(self.num_threads)
+            return SentenceTransformer(self.model_name, device="cpu")
+
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        try:
+            import onnxruntime
+            if self.num_threads > 0:
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.num_threads
+                model_kwargs["session_options"] = options
+        except ImportError:
+            print("Error: the ONNX backend needs optimum. Try: pip install 'optimum[onnxruntime]'")
+            raise
+
+        if self.backend == "onnx":
+            return SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+        local_dir, file_name = self._export_quantized_model()
+        model_kwargs["file_name"] = file_name
+        return SentenceTransformer(local_dir, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    def _export_quantized_model(self):
+        """Export a dynamically int8-quantized ONNX model once and reuse it"""
+        local_dir = os.path.join(ONNX_CACHE_DIR, self.model_name.replace("/", "__") + "-onnx")
+        file_name = f"onnx/model_qint8_{self.quantization}.onnx"
+        if not os.path.exists(os.path.join(local_dir, file_name)):
+            from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+            print(f"🔄 Exporting int8 ONNX model to {local_dir}...")
+            model = SentenceTransformer(self.model_name, device="cpu", backend="onnx")
+            model.save_pretrained(local_dir)
+            export_dynamic_quantized_onnx_model(model, self.quantization, local_dir)
+        return local_dir, file_name
+
+    def _encode(self, texts):
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+
+    def embed_documents(self, texts):
+        texts = [text.replace("\n", " ") for text in texts]
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, vector in zip(batch, self._encode([texts[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,166 @@
+"""Persistent on-disk cache of text embeddings.
+
+Vectors are appended to a raw float32 matrix that is read through a numpy
+memmap; a small sqlite table maps each text hash to its row. Appends are
+serialized through the sqlite write lock, so several processes can share a
+cache directory.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+metrics.describe("rag_embedding_cache_total", "Embedding cache lookups by result, per text")
+
+# sqlite limits the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """hash -> vector store backed by a memory-mapped float32 matrix"""
+
+    def __init__(self, cache_dir, model_key):
+        os.makedirs(cache_dir, exist_ok=True)
+        name = hashlib.sha256(model_key.encode("utf-8")).hexdigest()[:16]
+        self.model_key = model_key
+        self.matrix_path = os.path.join(cache_dir, f"{name}.f32")
+        self.index_path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vectors (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta VALUES ('model_key', ?)", (model_key,))
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+        self.dim = int(row[0]) if row else None
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def _rows_on_disk(self):
+        try:
+            return os.path.getsize(self.matrix_path) // (self.dim * 4)
+        except OSError:
+            return 0
+
+    def _view(self, max_row):
+        """Memmap covering at least ``max_row``, remapped only when the file has grown"""
+        if self._matrix is None or self._matrix.shape[0] <= max_row:
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r",
+                                     shape=(self._rows_on_disk(), self.dim))
+        return self._matrix
+
+    def get_many(self, hashes):
+        """Return ``{hash: vector}`` for the hashes that are cached"""
+        if self.dim is None or not hashes:
+            return {}
+        found = {}
+        with self._lock:
+            unique = list(set(hashes))
+            for start in range(0, len(unique), _LOOKUP_BATCH):
+                batch = unique[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                found.update(self._conn.execute(
+                    f"SELECT hash, row FROM vectors WHERE hash IN ({placeholders})", batch
+                ).fetchall())
+            if not found:
+                return {}
+            matrix = self._view(max(found.values()))
+            return {h: np.array(matrix[row]) for h, row in found.items()}
+
+    def put_many(self, hashes, vectors):
+        """Append vectors for hashes that are not cached yet"""
+        if not hashes:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(self.dim),))
+
+                new = {}
+                for h, vector in zip(hashes, vectors):
+                    new.setdefault(h, vector)
+                existing = set()
+                keys = list(new)
+                for start in range(0, len(keys), _LOOKUP_BATCH):
+                    batch = keys[start:start + _LOOKUP_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    existing.update(h for (h,) in self._conn.execute(
+                        f"SELECT hash FROM vectors WHERE hash IN ({placeholders})", batch
+                    ))
+                keys = [h for h in keys if h not in existing]
+                if not keys:
+                    self._conn.execute("COMMIT")
+                    return
+
+                # Rows are placed after whatever is on disk, even rows whose
+                # index insert never committed, so offsets never collide
+                first_row = self._rows_on_disk()
+                with open(self.matrix_path, "ab") as f:
+                    f.truncate(first_row * self.dim * 4)
+                    f.write(np.stack([new[h] for h in keys]).tobytes())
+                self._conn.executemany(
+                    "INSERT INTO vectors (hash, row) VALUES (?, ?)",
+                    [(h, first_row + i) for i, h in enumerate(keys)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only runs the model for texts it has not seen"""
+
+    def __init__(self, base, cache):
+        self.base = base
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        # Expose the wrapped model's settings (backend, batch_size, ...)
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(hashes)
+
+        # Embed each unseen text once, even if it repeats within the batch
+        missing = {}
+        for i, h in enumerate(hashes):
+            if h not in cached:
+                missing.setdefault(h, i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        metrics.inc("rag_embedding_cache_total", len(texts) - len(missing), result="hit")
+        metrics.inc("rag_embedding_cache_total", len(missing), result="miss")
+        if missing:
+            with metrics.span("embed.model") as span:
+                span["texts"] = len(missing)
+                vectors = self.base.embed_documents([texts[i] for i in missing.values()])
+            self.cache.put_many(list(missing), vectors)
+            cached.update(zip(missing, vectors))
+
+        return [np.asarray(cached[h], dtype=np.float32).tolist() for h in hashes]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -1,25 +1,73 @@
+import hashlib
+import json
 import os
-from PIL import Image
-import pytesseract
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 
-# Configure Tesseract path - update this path as needed
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-
-# Try different ways to import PyMuPDF
 try:
-    import fitz  # PyMuPDF
-    PYMUPDF_AVAILABLE = True
+    from . import metrics
 except ImportError:
+    import metrics
+
+# OCR and PDF libraries are imported on first use so that importing this
+# module (e.g. from the web app) stays cheap; worker processes load them once.
+TESSERACT_CMD = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+_modules = {}
+
+
+def _ocr():
+    """Return ``(Image, pytesseract)``, importing and configuring them on first use"""
+    if "ocr" not in _modules:
+        from PIL import Image
+        import pytesseract
+
+        # Configure Tesseract path - update this path as needed
+        pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        _modules["ocr"] = (Image, pytesseract)
+    return _modules["ocr"]
+
+
+def _pymupdf():
+    """Return the PyMuPDF module, or None if it is not installed"""
+    if "fitz" not in _modules:
+        # Try different ways to import PyMuPDF
+        try:
+            import fitz  # PyMuPDF
+        except ImportError:
+            try:
+                import pymupdf as fitz  # Alternative import
+            except ImportError:
+                print("Warning: PyMuPDF not available. PDF processing will be disabled.")
+                fitz = None
+        _modules["fitz"] = fitz
+    return _modules["fitz"]
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tiff")
+
+# Resolution used to render PDF pages that have no text layer before OCR
+OCR_DPI = 300
+
+# Bump when extraction output changes so cached text outputs are regenerated
+EXTRACTOR_VERSION = 3
+CACHE_FILENAME = ".ingest_cache.json"
+
+metrics.describe("rag_ingest_files_total", "Files seen by process_files, by outcome")
+metrics.describe("rag_ingest_tasks_total", "Images and PDF pages planned for extraction")
+
+def default_workers():
+    """Number of ingest worker processes (INGEST_WORKERS env var or CPU count)"""
     try:
-        import pymupdf as fitz  # Alternative import
-        PYMUPDF_AVAILABLE = True
-    except ImportError:
-        print("Warning: PyMuPDF not available. PDF processing will be disabled.")
-        PYMUPDF_AVAILABLE = False
+        workers = int(os.environ.get("INGEST_WORKERS", "0"))
+    except ValueError:
+        workers = 0
+    return workers if workers > 0 else (os.cpu_count() or 1)
 
 def extract_text_from_image(image_path):
     """Extract text from image using OCR"""
     try:
+        Image, pytesseract = _ocr()
         image = Image.open(image_path)
         text = pytesseract.image_to_string(image)
         return text
@@ -27,81 +75,349 @@ def extract_text_from_image(image_path):
         print(f"Error extracting text from image {image_path}: {e}")
         return ""
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF using PyMuPDF"""
-    if not PYMUPDF_AVAILABLE:
+def iter_pdf_pages(pdf_path):
+    """Yield the text of each PDF page in order using PyMuPDF"""
+    fitz = _pymupdf()
+    if fitz is None:
         print("PyMuPDF not available. Cannot process PDF files.")
-        return ""
-    
+        return
+
     try:
-        doc = fitz.open(pdf_path)
-        text = ""
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-        doc.close()
-        return text
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                yield page.get_text()
     except Exception as e:
         print(f"Error extracting text from PDF {pdf_path}: {e}")
-        return ""
 
-def extract_text_from_pdf_alternative(pdf_path):
-    """Alternative PDF text extraction using PyPDF2 (fallback)"""
+def iter_pdf_pages_alternative(pdf_path):
+    """Yield the text of each PDF page in order using PyPDF2 (fallback)"""
     try:
         import PyPDF2
         with open(pdf_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
             for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
+                yield page.extract_text() or ""
     except ImportError:
         print("PyPDF2 not available as fallback")
-        return ""
     except Exception as e:
         print(f"Error with PyPDF2 extraction: {e}")
-        return ""
 
-def process_files(input_dir, output_dir):
-    """Process all files in input directory and save extracted text to output directory"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    if not os.path.exists(input_dir):
-        print(f"Input directory {input_dir} does not exist")
-        return
-    
-    processed_files = []
-    
-    for filename in os.listdir(input_dir):
+def extract_text_from_pdf(pdf_path):
+    """Extract text from PDF using PyMuPDF"""
+    return "".join(iter_pdf_pages(pdf_path))
+
+def extract_text_from_pdf_alternative(pdf_path):
+    """Alternative PDF text extraction using PyPDF2 (fallback)"""
+    return "".join(iter_pdf_pages_alternative(pdf_path))
+
+def write_pages(out_file, pages):
+    """Stream page texts into ``out_file`` and return their character offsets.
+
+    The written text equals ``"".join(pages).strip()`` but only one page is
+    held in memory at a time. Returns a list of ``[start, end]`` offsets, one
+    per page, into the written text.
+    """
+    offsets = []
+    written = 0
+    pending = ""  # trailing whitespace, only written if more text follows
+    with open(out_file, "w", encoding="utf-8") as f:
+        for text in pages:
+            body = text.strip()
+            if body:
+                if written:
+                    # Keep the whitespace between pages, but not around the document
+                    gap = pending + text[:len(text) - len(text.lstrip())]
+                    f.write(gap)
+                    written += len(gap)
+                f.write(body)
+                start = written
+                written += len(body)
+                pending = text[len(text.rstrip()):]
+            else:
+                if written:
+                    pending += text
+                start = written
+            offsets.append([start, written])
+    return offsets
+
+def page_offsets_path(output_dir, filename):
+    """Path of the per-page offsets file written next to a text output"""
+    return os.path.join(output_dir, filename + ".pages.json")
+
+def load_page_offsets(output_dir, filename):
+    """Load the ``[start, end]`` page offsets recorded for a source file"""
+    path = page_offsets_path(output_dir, filename)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("pages", [])
+    except Exception as e:
+        print(f"Warning: could not read page offsets {path}: {e}")
+        return []
+
+def _page_text(page):
+    text = page.get_text()
+    if not text.strip():
+        # Image-only page: render it to a bitmap and OCR it
+        pix = page.get_pixmap(dpi=OCR_DPI)
+        Image, pytesseract = _ocr()
+        image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        text = pytesseract.image_to_string(image)
+    return text
+
+def extract_text_from_pdf_pages(pdf_path, page_nums):
+    """Extract the text of several PDF pages with one open, OCR-ing scanned pages"""
+    texts = []
+    with _pymupdf().open(pdf_path) as doc:
+        for page_num in page_nums:
+            try:
+                texts.append(_page_text(doc.load_page(page_num)))
+            except Exception as e:
+                print(f"Error extracting text from {pdf_path} (page {page_num}): {e}")
+                texts.append("")
+    return texts
+
+def _run_task(task):
+    """Worker entry point: return the page texts of one image, PDF or run of PDF pages"""
+    kind, path, arg = task
+    if kind == "text":
+        return [arg]
+    try:
+        if kind == "image":
+            return [extract_text_from_image(path)]
+        if kind == "pdf_pages":
+            return extract_text_from_pdf_pages(path, arg)
+        return [extract_text_from_pdf_alternative(path)]
+    except Exception as e:
+        print(f"Error extracting text from {path}: {e}")
+        return [""] * (len(arg) if kind == "pdf_pages" else 1)
+
+def file_hash(path):
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_ingest_cache(output_dir):
+    """Load the extraction cache stored in the output directory"""
+    path = os.path.join(output_dir, CACHE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: could not read ingest cache {path}: {e}")
+        return {}
+
+def save_ingest_cache(output_dir, cache):
+    """Atomically write the extraction cache"""
+    path = os.path.join(output_dir, CACHE_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _extractor_for(filename):
+    if filename.lower().endswith(IMAGE_EXTENSIONS):
+        return "tesseract"
+    if filename.lower().endswith(".pdf"):
+        return "pymupdf" if _pymupdf() is not None else "pypdf2"
+    return None
+
+def _is_current(entry, key, output_dir):
+    return (
+        entry is not None
+        and all(entry.get(field) == value for field, value in key.items())
+        and os.path.exists(os.path.join(output_dir, entry.get("output", "")))
+    )
+
+def _plan_tasks(input_dir, output_dir, cache, report):
+    """Split changed input files into page-level tasks, in file and page order.
+
+    Files whose cached text output is current are added to ``report["skipped"]``.
+    Returns the tasks and the cache keys of the files they belong to.
+    """
+    tasks = []
+    keys = {}
+    for filename in sorted(os.listdir(input_dir)):
         full_path = os.path.join(input_dir, filename)
-        text = ""
-        
-        if filename.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff")):
+        extractor = _extractor_for(filename)
+        if extractor is None or not os.path.isfile(full_path):
+            continue
+
+        try:
+            key = {"hash": file_hash(full_path), "extractor": extractor, "version": EXTRACTOR_VERSION}
+        except OSError as e:
+            print(f"Error reading {full_path}: {e}")
+            report["failed"].append(filename)
+            continue
+
+        if _is_current(cache.get(filename), key, output_dir):
+            report["skipped"].append(filename)
+            continue
+        keys[filename] = key
+
+        if extractor == "tesseract":
             print(f"Processing image: {filename}")
-            text = extract_text_from_image(full_path)
-            
-        elif filename.lower().endswith(".pdf"):
+            tasks.append((filename, ("image", full_path, None)))
+
+        elif extractor == "pypdf2":
             print(f"Processing PDF: {filename}")
-            text = extract_text_from_pdf(full_path)
-            
-            # Try alternative method if first one fails
-            if not text.strip():
-                print(f"Trying alternative PDF extraction for {filename}")
-                text = extract_text_from_pdf_alternative(full_path)
+            tasks.append((filename, ("pdf_alternative", full_path, None)))
+
         else:
-            continue
-        
-        if text.strip():
-            out_file = os.path.join(output_dir, filename + ".txt")
-            with open(out_file, "w", encoding="utf-8") as f:
-                f.write(text.strip())
-            processed_files.append(filename)
-            print(f"Successfully processed: {filename}")
+            print(f"Processing PDF: {filename}")
+            # Text layers are cheap to read here; only scanned pages are left for OCR
+            file_tasks = []
+            try:
+                with _pymupdf().open(full_path) as doc:
+                    for page_num, page in enumerate(doc):
+                        text = page.get_text()
+                        if text.strip():
+                            file_tasks.append((filename, ("text", None, text)))
+                        else:
+                            file_tasks.append((filename, ("pdf_pages", full_path, [page_num])))
+            except Exception as e:
+                print(f"Error opening PDF {full_path}: {e}")
+                report["failed"].append(filename)
+                del keys[filename]
+                continue
+            if not file_tasks:
+                # No pages means no tasks, so the file would never be finished
+                print(f"No pages in PDF: {filename}")
+                report["failed"].append(filename)
+                del keys[filename]
+                continue
+            tasks.extend(file_tasks)
+    return tasks, keys
+
+def _batch_pages(tasks, workers):
+    """Merge consecutive scanned pages of a PDF into tasks of about one share per worker"""
+    pages = sum(len(task[2]) for _, task in tasks if task[0] == "pdf_pages")
+    size = max(1, -(-pages // max(1, workers)))
+    batched = []
+    for filename, task in tasks:
+        previous = batched[-1][1] if batched else None
+        if (task[0] == "pdf_pages" and previous is not None and previous[0] == "pdf_pages"
+                and previous[1] == task[1] and len(previous[2]) < size):
+            previous[2].extend(task[2])
+        elif task[0] == "pdf_pages":
+            batched.append((filename, (task[0], task[1], list(task[2]))))
         else:
-            print(f"No text extracted from: {filename}")
+            batched.append((filename, task))
+    return batched
+
+def _iter_results(tasks, workers):
+    """Yield (filename, text) for every page, preserving task order.
+
+    Pages whose text layer was read while planning are passed through; the
+    OCR tasks go to a pool of at most ``workers`` processes, and run in this
+    process when there is only one of them.
+    """
+    tasks = _batch_pages(tasks, workers)
+    ocr_tasks = [task for _, task in tasks if task[0] != "text"]
+    workers = min(workers, len(ocr_tasks))
+    if workers <= 1:
+        for filename, task in tasks:
+            for text in _run_task(task):
+                yield filename, text
+        return
+
+    chunksize = max(1, len(ocr_tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_run_task, ocr_tasks, chunksize=chunksize)
+        for filename, task in tasks:
+            for text in (_run_task(task) if task[0] == "text" else next(results)):
+                yield filename, text
+
+def _write_output(input_dir, output_dir, filename, pages):
+    """Stream a file's pages to its text output and record the page offsets"""
+    out_file = os.path.join(output_dir, filename + ".txt")
+    tmp_file = out_file + ".tmp"
+    offsets = write_pages(tmp_file, pages)
+
+    # Try alternative method if PyMuPDF and OCR found nothing
+    if not any(end > start for start, end in offsets) and filename.lower().endswith(".pdf") and _pymupdf() is not None:
+        print(f"Trying alternative PDF extraction for {filename}")
+        offsets = write_pages(tmp_file, iter_pdf_pages_alternative(os.path.join(input_dir, filename)))
+
+    if any(end > start for start, end in offsets):
+        os.replace(tmp_file, out_file)
+        with open(page_offsets_path(output_dir, filename), "w", encoding="utf-8") as f:
+            json.dump({"source": filename + ".txt", "pages": offsets}, f)
+        print(f"Successfully processed: {filename}")
+        return True
+
+    os.remove(tmp_file)
+    print(f"No text extracted from: {filename}")
+    return False
+
+def process_files(input_dir, output_dir, workers=None, progress=None):
+    """Process all files in input directory and save extracted text to output directory.
+
+    Files whose text output is already current for their content hash are
+    skipped. PDF text layers are read in this process; images and scanned PDF
+    pages of the remaining files are OCR'd in parallel by a pool of up to
+    ``workers`` processes (defaults to ``default_workers()``, never more than
+    there are OCR tasks); each output file is written page by page in order,
+    with per-page offsets in ``<name>.pages.json``.
+
+    ``progress``, if given, is called as ``progress(done, total)`` after each file.
+
+    Returns a dict listing the ``processed``, ``skipped`` and ``failed`` files.
+    """
+    report = {"processed": [], "skipped": [], "failed": []}
+    os.makedirs(output_dir, exist_ok=True)
+    
+    if not os.path.exists(input_dir):
+        print(f"Input directory {input_dir} does not exist")
+        return report
     
-    print(f"Processing complete. {len(processed_files)} files processed.")
-    return processed_files
+    if workers is None:
+        workers = default_workers()
+
+    cache = load_ingest_cache(output_dir)
+    with metrics.span("ingest.plan"):
+        tasks, keys = _plan_tasks(input_dir, output_dir, cache, report)
+
+    finished = []
+
+    def finish(filename, pages):
+        if _write_output(input_dir, output_dir, filename, pages):
+            cache[filename] = dict(keys[filename], output=filename + ".txt")
+            report["processed"].append(filename)
+        else:
+            cache.pop(filename, None)
+            report["failed"].append(filename)
+        finished.append(filename)
+        if progress is not None:
+            progress(len(finished), len(keys))
+
+    try:
+        with metrics.span("ingest.extract") as span:
+            span.update(tasks=len(tasks), workers=workers)
+            # Results arrive in task order, so each file's pages are contiguous
+            for filename, results in groupby(_iter_results(tasks, workers), key=itemgetter(0)):
+                finish(filename, (text for _, text in results))
+    finally:
+        # Forget files that are no longer in the input directory
+        present = set(report["skipped"]) | set(report["processed"])
+        for filename in [f for f in cache if f not in present and f not in keys]:
+            del cache[filename]
+        save_ingest_cache(output_dir, cache)
+
+    metrics.inc("rag_ingest_tasks_total", len(tasks))
+    for result in ("processed", "skipped", "failed"):
+        metrics.inc("rag_ingest_files_total", len(report[result]), result=result)
+    print(
+        f"Processing complete. {len(report['processed'])} files processed, "
+        f"{len(report['skipped'])} unchanged, {len(report['failed'])} failed."
+    )
+    return report
 
 def test_imports():
     """Test function to check if all required modules are available"""
@@ -109,6 +425,7 @@ def test_imports():
     
     # Test Tesseract
     try:
+        Image, pytesseract = _ocr()
         test_image = Image.new('RGB', (100, 30), color='white')
         pytesseract.image_to_string(test_image)
         print("✓ Tesseract OCR working")
@@ -116,7 +433,8 @@ def test_imports():
         print(f"✗ Tesseract OCR error: {e}")
     
     # Test PyMuPDF
-    if PYMUPDF_AVAILABLE:
+    fitz = _pymupdf()
+    if fitz is not None:
         try:
             # Test with a simple operation
             print(f"✓ PyMuPDF available (version: {fitz.version})")
@@ -0,0 +1,383 @@
+"""Persistent sqlite-backed ingest job queue with background worker processes"""
+import atexit
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+try:
+    from . import embed, ingest, metrics
+except ImportError:
+    import embed
+    import ingest
+    import metrics
+
+DEFAULT_DB_PATH = "data/jobs.sqlite3"
+
+# Share of the overall progress bar given to each pipeline stage
+STAGES = (("ingest", 0.6), ("load", 0.1), ("embed", 0.3))
+
+# Workers stamp their running job this often; a job not stamped for the
+# timeout belongs to a worker that died (portable, unlike probing its pid)
+HEARTBEAT_INTERVAL = float(os.environ.get("INGEST_HEARTBEAT_INTERVAL", "5"))
+HEARTBEAT_TIMEOUT = float(os.environ.get("INGEST_HEARTBEAT_TIMEOUT", "30"))
+
+_workers = []
+_stop_event = None
+
+metrics.describe("rag_ingest_queue_depth", "Ingest jobs waiting for a worker")
+metrics.describe("rag_ingest_jobs", "Ingest jobs by status")
+metrics.describe("rag_ingest_job_stage_seconds_total", "Time spent in each ingest job stage")
+metrics.describe("rag_ingest_job_chunks_total", "Chunks added or deleted by ingest jobs")
+
+
+def _connect(db_path=DEFAULT_DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            stage TEXT,
+            progress REAL NOT NULL DEFAULT 0,
+            input_dir TEXT NOT NULL,
+            output_dir TEXT NOT NULL,
+            persist_dir TEXT NOT NULL,
+            worker_pid INTEGER,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            timings TEXT NOT NULL DEFAULT '{}',
+            result TEXT,
+            error TEXT,
+            heartbeat_at REAL
+        )"""
+    )
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "heartbeat_at" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+    return conn
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["timings"] = json.loads(job["timings"] or "{}")
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def enqueue(input_dir="data/input_images", output_dir="data/text_outputs",
+            persist_dir="data/chroma_store", db_path=DEFAULT_DB_PATH):
+    """Queue an ingest job and return its id.
+
+    If an identical job is still waiting it is reused, since one run picks up
+    every file in the input directory anyway.
+    """
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' AND input_dir = ? AND output_dir = ? AND persist_dir = ?",
+            (input_dir, output_dir, persist_dir)
+        ).fetchone()
+        if row is not None:
+            conn.execute("COMMIT")
+            return row["id"]
+
+        job_id = uuid.uuid4().hex
+        conn.execute(
+            "INSERT INTO jobs (id, status, input_dir, output_dir, persist_dir, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, input_dir, output_dir, persist_dir, time.time())
+        )
+        conn.execute("COMMIT")
+        return job_id
+    finally:
+        conn.close()
+
+
+def get_job(job_id, db_path=DEFAULT_DB_PATH):
+    """Return a job as a dict, or None if it does not exist"""
+    conn = _connect(db_path)
+    try:
+        return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def list_jobs(limit=50, db_path=DEFAULT_DB_PATH, persist_dir=None):
+    """Return the most recent jobs, newest first, optionally only those writing to ``persist_dir``"""
+    conn = _connect(db_path)
+    try:
+        if persist_dir is None:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE persist_dir = ? ORDER BY created_at DESC LIMIT ?", (persist_dir, limit)
+            ).fetchall()
+        return [_row_to_job(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def queue_depth(db_path=DEFAULT_DB_PATH):
+    """Number of jobs waiting to be picked up"""
+    conn = _connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def collect_metrics(db_path=DEFAULT_DB_PATH):
+    """Metrics samples for the job queue, read from the shared database.
+
+    Ingest runs in worker processes, so job counts, stage timings and chunk
+    counts are aggregated from the jobs table instead of in-process counters.
+    """
+    conn = _connect(db_path)
+    try:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        samples = [("gauge", "rag_ingest_queue_depth", {}, counts.get("queued", 0))]
+        for status in ("queued", "running", "done", "failed"):
+            samples.append(("gauge", "rag_ingest_jobs", {"status": status}, counts.get(status, 0)))
+
+        for stage, _ in STAGES:
+            path = f"$.{stage}"
+            total, runs = conn.execute(
+                "SELECT SUM(json_extract(timings, ?)), COUNT(json_extract(timings, ?)) FROM jobs",
+                (path, path)
+            ).fetchone()
+            samples.append(("counter", "rag_ingest_job_stage_seconds_total", {"stage": stage}, float(total or 0)))
+            samples.append(("counter", "rag_ingest_job_stage_runs_total", {"stage": stage}, runs))
+
+        for op in ("added", "deleted"):
+            total = conn.execute(
+                "SELECT SUM(json_extract(result, ?)) FROM jobs WHERE result IS NOT NULL", (f"$.chunks_{op}",)
+            ).fetchone()[0]
+            samples.append(("counter", "rag_ingest_job_chunks_total", {"op": op}, total or 0))
+        return samples
+    finally:
+        conn.close()
+
+
+def _claim_next(conn):
+    """Atomically mark the oldest runnable job as running and return it.
+
+    Jobs writing to a persist directory that another job is already writing
+    to are left waiting, so two workers never update the same index at once.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    row = conn.execute(
+        """SELECT * FROM jobs WHERE status = 'queued'
+           AND persist_dir NOT IN (SELECT persist_dir FROM jobs WHERE status = 'running')
+           ORDER BY created_at LIMIT 1"""
+    ).fetchone()
+    if row is None:
+        conn.execute("COMMIT")
+        return None
+    now = time.time()
+    conn.execute(
+        "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+        (os.getpid(), now, now, row["id"])
+    )
+    conn.execute("COMMIT")
+    return _row_to_job(row)
+
+
+def _update(conn, job_id, **fields):
+    for key in ("timings", "result"):
+        if key in fields:
+            fields[key] = json.dumps(fields[key])
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def run_job(conn, job):
+    """Run the ingest -> load -> embed pipeline for one claimed job"""
+    job_id = job["id"]
+    timings = {}
+    result = {}
+    base = 0.0
+
+    def stage_progress(weight):
+        def report(done, total):
+            if total:
+                _update(conn, job_id, progress=round(base + weight * done / total, 4))
+        return report
+
+    try:
+        for stage, weight in STAGES:
+            _update(conn, job_id, stage=stage, progress=round(base, 4))
+            started = time.perf_counter()
+
+            if stage == "ingest":
+                report = ingest.process_files(job["input_dir"], job["output_dir"], progress=stage_progress(weight))
+                result.update({key: report[key] for key in ("processed", "skipped", "failed")})
+            elif stage == "load":
+                docs = embed.load_texts(job["output_dir"])
+                result["documents"] = len(docs)
+            elif stage == "embed":
+                # The API process cannot see this worker's metrics, so keep the counts with the job
+                before = {op: metrics.counter_value("rag_chunks_total", op=op) for op in ("added", "deleted")}
+                if docs and embed.embed_documents(docs, job["persist_dir"]) is None:
+                    raise RuntimeError("Embedding failed, see worker log for details")
+                for op, count in before.items():
+                    result[f"chunks_{op}"] = metrics.counter_value("rag_chunks_total", op=op) - count
+
+            timings[stage] = round(time.perf_counter() - started, 3)
+            base += weight
+            _update(conn, job_id, timings=timings)
+
+        _update(conn, job_id, status="done", stage=None, progress=1.0,
+                finished_at=time.time(), result=result)
+        print(f"✅ Job {job_id} finished in {sum(timings.values()):.1f}s")
+    except Exception as e:
+        traceback.print_exc()
+        _update(conn, job_id, status="failed", finished_at=time.time(),
+                timings=timings, result=result, error=str(e))
+        print(f"❌ Job {job_id} failed: {e}")
+
+
+def _heartbeat(db_path, stop, interval=HEARTBEAT_INTERVAL):
+    """Stamp the jobs this process is running until ``stop`` is set"""
+    conn = _connect(db_path)
+    try:
+        while True:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND worker_pid = ?",
+                (time.time(), os.getpid())
+            )
+            if stop.wait(interval):
+                return
+    finally:
+        conn.close()
+
+
+def worker_main(db_path=DEFAULT_DB_PATH, stop_event=None, poll_interval=1.0):
+    """Worker process loop: claim queued jobs and run them until stopped"""
+    conn = _connect(db_path)
+    print(f"🔧 Ingest worker {os.getpid()} started")
+    # A thread, so long extraction steps without progress updates still count as alive
+    beating = threading.Event()
+    threading.Thread(target=_heartbeat, args=(db_path, beating), name="ingest-heartbeat", daemon=True).start()
+    try:
+        while stop_event is None or not stop_event.is_set():
+            job = _claim_next(conn)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            run_job(conn, job)
+    finally:
+        beating.set()
+        conn.close()
+
+
+def _stale_before(timeout=None):
+    return time.time() - (HEARTBEAT_TIMEOUT if timeout is None else timeout)
+
+
+def _requeue_orphans(db_path):
+    """Put jobs whose worker process died back in the queue"""
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (_stale_before(),)
+        ).fetchall()
+        for row in rows:
+            _update(conn, row["id"], status="queued", worker_pid=None, stage=None, progress=0.0, heartbeat_at=None)
+            print(f"🔁 Requeued interrupted job {row['id']}")
+    finally:
+        conn.close()
+
+
+def fail_orphan(job_id, db_path=DEFAULT_DB_PATH, timeout=None):
+    """Mark a running job failed if its worker stopped sending heartbeats; True if it did"""
+    conn = _connect(db_path)
+    try:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'failed', finished_at = ?, "
+            "error = 'Ingest worker ' || IFNULL(worker_pid, '?') || ' stopped while running this job' "
+            "WHERE id = ? AND status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (time.time(), job_id, _stale_before(timeout))
+        )
+        if cursor.rowcount:
+            print(f"❌ Job {job_id} failed: its worker stopped sending heartbeats")
+        return cursor.rowcount > 0
+    finally:
+        conn.close()
+
+
+def start_workers(count=None, db_path=DEFAULT_DB_PATH):
+    """Start background worker processes once per process (INGEST_JOB_WORKERS, default 1)"""
+    global _stop_event
+    if _workers:
+        return _workers
+
+    if count is None:
+        count = int(os.environ.get("INGEST_JOB_WORKERS", "1"))
+    _requeue_orphans(db_path)
+
+    ctx = multiprocessing.get_context("spawn")
+    _stop_event = ctx.Event()
+    for _ in range(count):
+        # Not daemonic: workers run their own process pool for OCR
+        process = ctx.Process(target=worker_main, args=(db_path, _stop_event), name="ingest-worker")
+        process.start()
+        _workers.append(process)
+    atexit.register(stop_workers)
+    return _workers
+
+
+def stop_workers(timeout=5.0):
+    """Ask the worker processes to finish their current job and exit"""
+    if _stop_event is not None:
+        _stop_event.set()
+    for process in _workers:
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+    _workers.clear()
+
+
+def _liveness_worker(db_path, claimed, interval):
+    conn = _connect(db_path)
+    _claim_next(conn)
+    claimed.set()
+    _heartbeat(db_path, threading.Event(), interval)
+
+
+def test_worker_liveness(interval=0.2, timeout=1.0):
+    """Check that a live worker keeps its job and a killed worker's job fails"""
+    import tempfile
+
+    print("🔧 Testing worker liveness...")
+    db_path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    job_id = enqueue(db_path=db_path)
+    ctx = multiprocessing.get_context("spawn")
+    claimed = ctx.Event()
+    process = ctx.Process(target=_liveness_worker, args=(db_path, claimed, interval))
+    process.start()
+    claimed.wait(30)
+
+    time.sleep(timeout * 2)
+    alive = not fail_orphan(job_id, db_path, timeout=timeout)
+    print("✓" if alive else "✗", "running worker keeps its job")
+
+    process.kill()
+    process.join()
+    time.sleep(timeout * 2)
+    failed = fail_orphan(job_id, db_path, timeout=timeout)
+    print("✓" if failed else "✗", "killed worker's job is failed:", get_job(job_id, db_path)["error"])
+
+
+if __name__ == "__main__":
+    test_worker_liveness()
@@ -0,0 +1,227 @@
+"""On-disk BM25 inverted index kept in sync with the Chroma collection"""
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+try:
+    from . import store
+except ImportError:
+    import store
+
+# Keeps terms like "c++", "c#", "node.js" and "aws-saa-c03" intact
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#.\-]*")
+
+_lock = threading.Lock()
+# index path -> (BM25Index, file mtime when loaded)
+_indexes = {}
+
+
+def tokenize(text):
+    """Lowercase the text and split it into search terms"""
+    return [token.rstrip(".-") for token in TOKEN_RE.findall(text.lower())]
+
+
+_OPERATORS = {
+    "$eq": lambda value, target: value == target,
+    "$ne": lambda value, target: value != target,
+    "$in": lambda value, target: value in target,
+    "$nin": lambda value, target: value not in target,
+    "$gt": lambda value, target: value is not None and value > target,
+    "$gte": lambda value, target: value is not None and value >= target,
+    "$lt": lambda value, target: value is not None and value < target,
+    "$lte": lambda value, target: value is not None and value <= target,
+}
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+def validate_where(where):
+    """Raise ValueError unless ``where`` is a filter that both Chroma and ``matches`` accept"""
+    if not isinstance(where, dict) or len(where) != 1:
+        raise ValueError(f"Expected a filter with exactly one key, got {where!r}")
+    (key, condition), = where.items()
+    if key in ("$and", "$or"):
+        if not isinstance(condition, list) or len(condition) < 2:
+            raise ValueError(f"Expected {key} to be a list of at least two filters, got {condition!r}")
+        for clause in condition:
+            validate_where(clause)
+    elif not isinstance(key, str) or key.startswith("$"):
+        raise ValueError(f"Unknown filter operator {key!r}")
+    elif isinstance(condition, dict):
+        if len(condition) != 1 or next(iter(condition)) not in _OPERATORS:
+            raise ValueError(f"Expected one of {', '.join(_OPERATORS)} for {key!r}, got {condition!r}")
+        (op, target), = condition.items()
+        if op in ("$in", "$nin"):
+            if not isinstance(target, list) or not all(map(_is_scalar, target)):
+                raise ValueError(f"Expected a list of values for {op}, got {target!r}")
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if not isinstance(target, (int, float)) or isinstance(target, bool):
+                raise ValueError(f"Expected a number for {op}, got {target!r}")
+        elif not _is_scalar(target):
+            raise ValueError(f"Expected a str, number or bool for {op}, got {target!r}")
+    elif not _is_scalar(condition):
+        raise ValueError(f"Expected a str, number, bool or operator for {key!r}, got {condition!r}")
+
+
+def matches(metadata, where):
+    """Evaluate a Chroma-style ``where`` filter against a metadata dict.
+
+    Supports plain equality, ``$and``/``$or`` and the comparison operators
+    ``$eq``, ``$ne``, ``$in``, ``$nin``, ``$gt``, ``$gte``, ``$lt``, ``$lte``.
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            if not all(_OPERATORS[op](value, target) for op, target in condition.items()):
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def index_path(persist_dir="data/chroma_store"):
+    """Path of the BM25 index file kept next to the persist directory (inside a snapshot)"""
+    if store.is_snapshot(persist_dir):
+        return os.path.join(persist_dir, "bm25.json")
+    return os.path.normpath(persist_dir) + ".bm25.json"
+
+
+class BM25Index:
+    """A small BM25 inverted index over chunk ids"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {chunk_id: term frequency}
+        self.docs = {}      # chunk_id -> {"length": int, "metadata": dict}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, chunk_id, text, metadata=None):
+        """Index a chunk, replacing any previous version with the same id"""
+        if chunk_id in self.docs:
+            self.remove(chunk_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+        length = sum(counts.values())
+        self.docs[chunk_id] = {"length": length, "metadata": metadata or {}, "terms": list(counts)}
+        self.total_length += length
+
+    def remove(self, chunk_id):
+        """Remove a chunk from the index if present"""
+        doc = self.docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        for term in doc["terms"]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= doc["length"]
+
+    def search(self, query, k=10, where=None):
+        """Return up to ``k`` ``(chunk_id, score)`` pairs, best first.
+
+        ``where`` is an optional Chroma-style metadata filter (see ``matches``).
+        """
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                length = self.docs[chunk_id]["length"]
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        if where:
+            scores = {
+                chunk_id: score for chunk_id, score in scores.items()
+                if matches(self.docs[chunk_id]["metadata"], where)
+            }
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def to_dict(self):
+        return {"k1": self.k1, "b": self.b, "docs": self.docs, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.docs = data.get("docs", {})
+        index.postings = data.get("postings", {})
+        index.total_length = sum(doc["length"] for doc in index.docs.values())
+        return index
+
+
+def load_index(persist_dir="data/chroma_store"):
+    """Load the BM25 index from disk, returning None if it does not exist"""
+    path = index_path(persist_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return BM25Index.from_dict(json.load(f))
+    except Exception as e:
+        print(f"⚠️ Could not read BM25 index {path}: {e}")
+        return None
+
+
+def save_index(index, persist_dir="data/chroma_store"):
+    """Atomically write the BM25 index to disk"""
+    path = index_path(persist_dir)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def get_index(persist_dir="data/chroma_store"):
+    """Return the cached BM25 index for a persist directory, reloading it when the file changes"""
+    if store.is_snapshot(persist_dir):
+        # Memory-mapped postings shared by every process serving the snapshot
+        index = getattr(store.get_vectorstore(persist_dir), "bm25", None)
+        if index is not None:
+            return index
+    path = index_path(persist_dir)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+    with _lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[1] == mtime:
+            return cached[0]
+        index = load_index(persist_dir)
+        if index is not None:
+            _indexes[path] = (index, mtime)
+        return index
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Merge several ranked id lists into one using reciprocal-rank fusion"""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,376 @@
+"""Shared gateway for all Ollama calls (question answering and summaries).
+
+Every LLM call in the process goes through one gateway that
+
+- limits the calls in flight per model (``LLM_CONCURRENCY``),
+- queues the rest in arrival order, handing each freed slot to the oldest
+  waiting call, and rejects new calls when too many are already waiting
+  (``LLM_QUEUE_SIZE``) or when a slot does not free up in time
+  (``LLM_QUEUE_TIMEOUT``), so overload fails fast instead of piling up,
+- only runs ``LLM_MAX_LOADED_MODELS`` different models at once: calls for
+  another model wait until the running one has had its turn
+  (``LLM_MODEL_SLICE``) and drains, instead of making Ollama swap gemma and
+  mistral in and out on every request,
+- shares the result of identical prompts that are already in flight, and
+- creates clients with ``keep_alive`` (``LLM_KEEP_ALIVE``, or forever for
+  ``LLM_PINNED_MODELS``) and a request timeout (``LLM_TIMEOUT``).
+
+``generate``/``agenerate`` return the completion; ``stream``/``astream``
+yield tokens while holding a slot. Rejections raise ``LLMOverloaded``.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+
+def _model_settings(value):
+    """Parse ``"gemma:2b=2,mistral:7b-instruct=1"`` into a dict"""
+    settings = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        model, _, number = item.rpartition("=")
+        if model:
+            settings[model.strip()] = int(number)
+    return settings
+
+
+# Calls in flight per model; Ollama only runs them in parallel with OLLAMA_NUM_PARALLEL > 1
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "1"))
+# Per-model overrides, e.g. "gemma:2b=2,mistral:7b-instruct=1"
+LLM_CONCURRENCY_MODELS = _model_settings(os.environ.get("LLM_CONCURRENCY_MODELS", ""))
+# Calls allowed to wait for a slot per model before new ones are rejected
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "32"))
+# Seconds a call may wait for a slot
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", "60"))
+# Seconds a single Ollama request may take
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+# Different models running at once (match OLLAMA_MAX_LOADED_MODELS; 0 = no limit)
+LLM_MAX_LOADED_MODELS = int(os.environ.get("LLM_MAX_LOADED_MODELS", "1"))
+# Seconds a running model keeps admitting calls before a waiting model may switch in
+LLM_MODEL_SLICE = float(os.environ.get("LLM_MODEL_SLICE", "10"))
+# How long Ollama keeps a model loaded after a call
+LLM_KEEP_ALIVE = os.environ.get("LLM_KEEP_ALIVE", "30m")
+# Seconds clients are told to wait before retrying a rejected call
+RETRY_AFTER_SECONDS = 5
+# Models kept loaded for good (keep_alive=-1), comma separated
+LLM_PINNED_MODELS = {m.strip() for m in os.environ.get("LLM_PINNED_MODELS", "").split(",") if m.strip()}
+
+metrics.describe("rag_llm_queue_wait_seconds", "Time LLM calls waited for a gateway slot")
+metrics.describe("rag_llm_rejected_total", "LLM calls rejected by the gateway, by reason")
+metrics.describe("rag_llm_coalesced_total", "LLM calls served by an identical call already in flight")
+
+
+class LLMOverloaded(RuntimeError):
+    """The gateway queue for a model is full or a slot did not free up in time"""
+
+
+class _Waiter:
+    """A call queued for a slot; a freed slot is handed to it directly"""
+    __slots__ = ("model", "granted", "event", "loop", "future")
+
+    def __init__(self, model, loop=None):
+        self.model = model
+        self.granted = False
+        # Threads wait on an event, coroutines on a future of their own loop
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+class _SharedCall:
+    """One LLM call and the number of callers waiting for its result"""
+    __slots__ = ("key", "future", "callers", "task", "loop")
+
+    def __init__(self, key):
+        self.key = key
+        self.future = Future()
+        self.callers = 1
+        self.task = None
+        self.loop = None
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMGateway:
+    def __init__(self, concurrency=LLM_CONCURRENCY, per_model=None, queue_size=LLM_QUEUE_SIZE,
+                 queue_timeout=LLM_QUEUE_TIMEOUT, max_loaded_models=LLM_MAX_LOADED_MODELS,
+                 model_slice=LLM_MODEL_SLICE):
+        self.concurrency = concurrency
+        self.per_model = dict(LLM_CONCURRENCY_MODELS if per_model is None else per_model)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_loaded_models = max_loaded_models
+        self.model_slice = model_slice
+        self._lock = threading.Lock()
+        self._running = {}  # model -> calls in flight
+        self._queue = deque()  # waiting calls, oldest first
+        self._switched_at = 0.0  # when the running models last changed
+        self._inflight = {}  # (model, prompt) -> _SharedCall of identical calls
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+
+    # Clients
+
+    def get_client(self, model, temperature=0.2):
+        """Return the Ollama client for ``model``, created on first use"""
+        key = (model, temperature)
+        if key not in self._clients:
+            with self._clients_lock:
+                if key not in self._clients:
+                    from langchain_ollama import OllamaLLM
+
+                    keep_alive = -1 if model in LLM_PINNED_MODELS else LLM_KEEP_ALIVE
+                    self._clients[key] = OllamaLLM(
+                        model=model,
+                        temperature=temperature,
+                        keep_alive=keep_alive,
+                        client_kwargs={"timeout": LLM_TIMEOUT},
+                    )
+        return self._clients[key]
+
+    # Admission
+
+    def limit(self, model):
+        return max(1, self.per_model.get(model, self.concurrency))
+
+    def _blocked_by(self, model):
+        """None if a call for ``model`` can start now, else "busy" or "switch" (another model is loaded)"""
+        if self._running.get(model, 0) >= self.limit(model):
+            return "busy"
+        if self.max_loaded_models and model not in self._running and len(self._running) >= self.max_loaded_models:
+            return "switch"
+        return None
+
+    def _grant(self):
+        """Hand free slots to queued calls in arrival order (lock held)"""
+        now = time.perf_counter()
+        blocked = set()  # models whose older call must start first
+        for waiter in list(self._queue):
+            if waiter.model in blocked:
+                continue
+            reason = self._blocked_by(waiter.model)
+            if reason is None:
+                self._queue.remove(waiter)
+                if waiter.model not in self._running:
+                    self._switched_at = now
+                self._running[waiter.model] = self._running.get(waiter.model, 0) + 1
+                waiter.granted = True
+                waiter.wake()
+            elif reason == "switch" and now - self._switched_at >= self.model_slice:
+                # The loaded model has had its turn: start nothing newer until it drains
+                break
+            else:
+                blocked.add(waiter.model)
+
+    def _enqueue(self, model, loop=None):
+        with self._lock:
+            if sum(1 for waiter in self._queue if waiter.model == model) >= self.queue_size:
+                metrics.inc("rag_llm_rejected_total", model=model, reason="queue_full")
+                raise LLMOverloaded(f"LLM queue for {model} is full ({self.queue_size} calls waiting)")
+            waiter = _Waiter(model, loop)
+            self._queue.append(waiter)
+            self._grant()
+            return waiter
+
+    def _admitted(self, waiter, started):
+        """Raise if ``waiter`` timed out, otherwise record its wait"""
+        with self._lock:
+            if not waiter.granted:
+                self._queue.remove(waiter)
+                self._grant()
+                metrics.inc("rag_llm_rejected_total", model=waiter.model, reason="timeout")
+                raise LLMOverloaded(f"No LLM slot for {waiter.model} within {self.queue_timeout:g}s")
+        metrics.observe("rag_llm_queue_wait_seconds", time.perf_counter() - started, model=waiter.model)
+
+    def _acquire(self, model):
+        started = time.perf_counter()
+        waiter = self._enqueue(model)
+        if not waiter.granted:
+            waiter.event.wait(self.queue_timeout)
+        self._admitted(waiter, started)
+
+    async def _aacquire(self, model):
+        # Waits on the event loop, so queued calls never tie up executor threads
+        started = time.perf_counter()
+        waiter = self._enqueue(model, asyncio.get_running_loop())
+        if not waiter.granted:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+        self._admitted(waiter, started)
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                self._queue.remove(waiter)
+                self._grant()
+                return
+        self._release(waiter.model)
+
+    def _release(self, model):
+        with self._lock:
+            self._running[model] -= 1
+            if not self._running[model]:
+                del self._running[model]
+            self._grant()
+
+    # Calls
+
+    def _join(self, model, prompt):
+        """Return ``(call, owner)``; only the owner starts the call, the others wait on it"""
+        key = (model, prompt)
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is not None:
+                call.callers += 1
+                metrics.inc("rag_llm_coalesced_total", model=model)
+                return call, False
+            call = self._inflight[key] = _SharedCall(key)
+            return call, True
+
+    def _leave(self, call):
+        """A caller stopped waiting; cancel the call once nobody is left"""
+        with self._lock:
+            call.callers -= 1
+            if call.callers or call.future.done():
+                return
+            if self._inflight.get(call.key) is call:
+                del self._inflight[call.key]
+            task = call.task
+        if task is not None:
+            call.loop.call_soon_threadsafe(task.cancel)
+
+    def _settle(self, call, result=None, error=None, cancelled=False):
+        with self._lock:
+            if self._inflight.get(call.key) is call:
+                del self._inflight[call.key]
+        if cancelled:
+            call.future.cancel()
+        elif error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    def _wait_shared(self, call):
+        try:
+            return call.future.result(timeout=self.queue_timeout + LLM_TIMEOUT)
+        except FuturesTimeout:
+            self._leave(call)
+            raise LLMOverloaded(f"No answer from a shared {call.key[0]} call within "
+                                f"{self.queue_timeout + LLM_TIMEOUT:g}s")
+
+    def generate(self, model, prompt, client=None):
+        """Completion of ``prompt`` by ``model``, waiting for a slot if needed"""
+        call, owner = self._join(model, prompt)
+        if not owner:
+            return self._wait_shared(call)
+        try:
+            self._acquire(model)
+            try:
+                result = _text((client or self.get_client(model)).invoke(prompt))
+            finally:
+                self._release(model)
+        except Exception as e:
+            self._settle(call, error=e)
+            raise
+        except BaseException:
+            # Interrupted (e.g. KeyboardInterrupt): don't hand that to the other callers
+            self._settle(call, error=RuntimeError(f"Shared {model} call was interrupted"))
+            raise
+        self._settle(call, result)
+        return result
+
+    async def _agenerate(self, model, prompt, client):
+        await self._aacquire(model)
+        try:
+            return _text(await (client or self.get_client(model)).ainvoke(prompt))
+        finally:
+            self._release(model)
+
+    async def agenerate(self, model, prompt, client=None):
+        """Async generate; the event loop is never blocked while waiting.
+
+        The call runs as its own task, so if the caller that started it is
+        cancelled (e.g. its client disconnected) it goes on for the other
+        callers of the same prompt; it is only cancelled when nobody waits.
+        """
+        call, owner = self._join(model, prompt)
+        if owner:
+            call.loop = asyncio.get_running_loop()
+            call.task = asyncio.ensure_future(self._agenerate(model, prompt, client))
+            call.task.add_done_callback(lambda task: self._settle(
+                call,
+                result=None if task.cancelled() or task.exception() else task.result(),
+                error=None if task.cancelled() else task.exception(),
+                cancelled=task.cancelled(),
+            ))
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(call.future)),
+                                          None if owner else self.queue_timeout + LLM_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._leave(call)
+            raise LLMOverloaded(f"No answer from a shared {model} call within "
+                                f"{self.queue_timeout + LLM_TIMEOUT:g}s")
+        except asyncio.CancelledError:
+            self._leave(call)
+            raise
+
+    def stream(self, model, prompt, client=None):
+        """Yield the tokens of a completion, holding a slot until it ends"""
+        self._acquire(model)
+        try:
+            for token in (client or self.get_client(model)).stream(prompt):
+                yield _text(token)
+        finally:
+            self._release(model)
+
+    async def astream(self, model, prompt, client=None):
+        await self._aacquire(model)
+        try:
+            async for token in (client or self.get_client(model)).astream(prompt):
+                yield _text(token)
+        finally:
+            self._release(model)
+
+    def collect_metrics(self):
+        with self._lock:
+            running, waiting = dict(self._running), {}
+            for waiter in self._queue:
+                waiting[waiter.model] = waiting.get(waiter.model, 0) + 1
+        samples = [("gauge", "rag_llm_running", {"model": m}, n) for m, n in sorted(running.items())]
+        samples += [("gauge", "rag_llm_waiting", {"model": m}, n) for m, n in sorted(waiting.items())]
+        return samples
+
+
+def _text(response):
+    return response if isinstance(response, str) else str(response)
+
+
+gateway = LLMGateway()
+metrics.register_collector(gateway.collect_metrics)
+
+get_client = gateway.get_client
+generate = gateway.generate
+agenerate = gateway.agenerate
+stream = gateway.stream
+astream = gateway.astream
@@ -0,0 +1,173 @@
+"""In-process metrics and timing spans, exported in the Prometheus text format.
+
+Counters and histograms live in a process-wide registry. ``span()`` times a
+block into the ``rag_span_duration_seconds`` histogram and, while a request
+trace is active (see ``trace()``), also appends it to that trace. Values
+computed at scrape time (e.g. the job queue, which lives in sqlite and is
+shared with the worker processes) come from collectors registered with
+``register_collector``.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+# Latency buckets in seconds, from cache hits to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Buckets for sizes (tokens, chunks)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+SPAN_METRIC = "rag_span_duration_seconds"
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_buckets = {}     # name -> buckets
+_help = {}
+_collectors = []
+
+_trace = contextvars.ContextVar("rag_trace", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name, text):
+    """Set the HELP line of a metric"""
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    """Add ``value`` to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def counter_value(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """Record one observation in a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        bounds = _buckets.setdefault(name, tuple(buckets))
+        state = _histograms.get(key)
+        if state is None:
+            state = _histograms[key] = [0] * len(bounds) + [0.0, 0]
+        for i, bound in enumerate(bounds):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """Time a block as ``rag_span_duration_seconds{span=name}``.
+
+    Yields a dict; anything put in it (counts, sizes) is kept with the span
+    in the request trace.
+    """
+    attributes = {}
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        observe(SPAN_METRIC, elapsed, span=name, **labels)
+        spans = _trace.get()
+        if spans is not None:
+            spans.append(dict(attributes, span=name, ms=round(elapsed * 1000, 2), status=status, **labels))
+
+
+@contextlib.contextmanager
+def trace():
+    """Collect the spans recorded in this context (and threads it spawns) into a list"""
+    spans = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+
+def register_collector(collector):
+    """Register ``collector() -> [(kind, name, labels, value)]`` evaluated on every scrape.
+
+    ``kind`` is "counter" or "gauge".
+    """
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    families = {}  # name -> (kind, [lines])
+
+    def family(name, kind):
+        if name not in families:
+            families[name] = (kind, [])
+        return families[name][1]
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(state) for key, state in _histograms.items()}
+        buckets = dict(_buckets)
+
+    for (name, labels), value in sorted(counters.items()):
+        family(name, "counter").append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+    for (name, labels), state in sorted(histograms.items()):
+        lines = family(name, "histogram")
+        for bound, count in zip(buckets[name], state):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {state[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {state[-1]}")
+
+    for collector in list(_collectors):
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"⚠️ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        for kind, name, labels, value in samples:
+            family(name, kind).append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+
+    output = []
+    for name, (kind, lines) in families.items():
+        if name in _help:
+            output.append(f"# HELP {name} {_help[name]}")
+        output.append(f"# TYPE {name} {kind}")
+        output.extend(lines)
+    return "\n".join(output) + "\n"
+
+
+def reset():
+    """Clear all recorded values (collectors stay registered)"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+describe(SPAN_METRIC, "Duration of pipeline stages in seconds")
@@ -1,32 +1,45 @@
+import asyncio
+import json
 import os
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnableMap
-from langchain_chroma import Chroma
+import threading
+import time
 
-# Consistent embedding import
 try:
-    from langchain_huggingface import HuggingFaceEmbeddings
+    from . import context as context_builder, lexical, llm_gateway, metrics, rerank as reranking, store
+    from .answer_cache import answer_cache
 except ImportError:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-
-# Initialize embeddings
-embeddings = HuggingFaceEmbeddings(
-    model_name="BAAI/bge-small-en",
-    model_kwargs={"device": "cpu"},
-    encode_kwargs={"normalize_embeddings": True}
-)
-
-# Initialize LLM (Ollama)
-try:
-    llm = OllamaLLM(model="gemma:2b", temperature=0.2)
-except Exception as e:
-    print(f"❌ Warning: Failed to initialize Ollama LLM: {e}")
-    llm = None
+    import context as context_builder
+    import lexical
+    import llm_gateway
+    import metrics
+    import rerank as reranking
+    import store
+    from answer_cache import answer_cache
+
+# Chunks sent to the LLM; hybrid retrieval needs far fewer than dense-only
+DENSE_K = 12
+HYBRID_K = 6
+# Candidates taken from each retriever before rank fusion
+FUSION_CANDIDATES = 20
+
+# Approximate prompt tokens spent on retrieved context
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1000"))
+# Set to e.g. 0.7 to reorder context blocks by MMR diversity before packing
+CONTEXT_MMR_LAMBDA = float(os.environ["CONTEXT_MMR_LAMBDA"]) if os.environ.get("CONTEXT_MMR_LAMBDA") else None
+
+LLM_MODEL = "gemma:2b"
+
+# LLM calls a batch of questions submits to the gateway at once (the gateway
+# still applies its own per-model limit)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+
+metrics.describe("rag_answer_cache_total", "Answer cache lookups by result")
+metrics.describe("rag_retrieved_chunks", "Chunks returned by retrieval per question")
+metrics.describe("rag_prompt_tokens", "Estimated prompt tokens sent to the LLM per question")
+metrics.describe("rag_llm_first_token_seconds", "Time from sending the prompt to the first streamed token")
 
 # 💬 Refined Prompt Template for accurate skill extraction
-prompt = PromptTemplate.from_template(
-    """You are an AI assistant helping extract factual information from resumes.
+PROMPT_TEMPLATE = """You are an AI assistant helping extract factual information from resumes.
 
 The user question is about a person's skills. From the context below, extract a full, clean list of **skills, tools, and soft skills** mentioned.
 
@@ -39,60 +52,480 @@ Question:
 {question}
 
 Answer:"""
-)
 
-# Chain connection
-chain = prompt | llm if llm else None
+_llm_lock = threading.Lock()
+_llm = None
+_chain = None
+
+def get_llm():
+    """Return the Ollama LLM client from the shared gateway, creating it on first use (None if that fails)"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                try:
+                    _llm = llm_gateway.get_client(LLM_MODEL, temperature=0.2)
+                except Exception as e:
+                    print(f"❌ Warning: Failed to initialize Ollama LLM: {e}")
+                    return None
+    return _llm
+
+def get_chain():
+    """Return the prompt | LLM chain, creating it on first use (None without an LLM)"""
+    global _chain
+    if _chain is None:
+        llm = get_llm()
+        if llm is None:
+            return None
+        from langchain_core.prompts import PromptTemplate
+        _chain = PromptTemplate.from_template(PROMPT_TEMPLATE) | llm
+    return _chain
+
+def __getattr__(name):
+    # Models and clients are created lazily on first use
+    if name == "embeddings":
+        return store.get_embeddings()
+    if name == "llm":
+        return get_llm()
+    if name == "chain":
+        return get_chain()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warmup(persist_dir="data/chroma_store", llm=True):
+    """Load the embedding model, vector store, BM25 index, reranker and LLM client ahead of the first question"""
+    store.get_embeddings().embed_query("warmup")
+    if os.path.exists(persist_dir):
+        store.get_vectorstore(persist_dir)
+        lexical.get_index(persist_dir)
+    if reranking.RERANK_ENABLED:
+        reranking.get_reranker()
+    if llm:
+        get_llm()
+    print("✓ Query pipeline warmed up")
 
 def check_ollama_connection():
     try:
+        llm = get_llm()
         if llm is None:
             return False, "LLM not initialized"
-        test = llm.invoke("Hello")
+        test = llm_gateway.generate(LLM_MODEL, "Hello", client=llm)
         return True, "Ollama connection successful"
     except Exception as e:
         return False, f"Ollama connection failed: {e}"
 
-def ask_question(query, persist_dir="data/chroma_store"):
-    if chain is None:
-        return "❌ Ollama not initialized. Please run `ollama run gemma:2b`."
+def _to_documents(ids, texts, metadatas):
+    from langchain_core.documents import Document
+    docs = []
+    for chunk_id, text, metadata in zip(ids, texts, metadatas):
+        metadata = dict(metadata or {}, id=chunk_id)
+        docs.append(Document(page_content=text or "", metadata=metadata))
+    return docs
+
+def section_filter(sections):
+    """Chroma ``where`` filter limiting a search to chunks of the given sections, or None"""
+    if not sections:
+        return None
+    if isinstance(sections, str):
+        sections = [sections]
+    sections = sorted({section.strip().lower() for section in sections})
+    return {"section": sections[0]} if len(sections) == 1 else {"section": {"$in": sections}}
+
+def _dense_search(db, query, n, embedding=None, where=None):
+    """Return the ids, texts and metadatas of the ``n`` nearest chunks matching ``where``"""
+    if embedding is None:
+        with metrics.span("query.embed"):
+            embedding = store.get_embeddings().embed_query(query)
+    with metrics.span("retrieve.dense") as span:
+        span["k"] = n
+        results = db._collection.query(
+            query_embeddings=[embedding],
+            n_results=n,
+            where=where or None,
+            include=["documents", "metadatas"]
+        )
+    return results["ids"][0], results["documents"][0], results["metadatas"][0]
+
+def retrieve(query, persist_dir="data/chroma_store", k=HYBRID_K, hybrid=True, embedding=None, where=None):
+    """Retrieve the ``k`` most relevant chunks for a query.
+
+    With ``hybrid`` the dense Chroma results are merged with BM25 results from
+    the lexical index using reciprocal-rank fusion, which ranks exact terms
+    (names, tools, certification IDs) much better than dense search alone.
+    A precomputed query ``embedding`` can be passed to skip embedding again.
+    ``where`` is a Chroma metadata filter (e.g. ``section_filter("skills")``)
+    applied to both retrievers, so only matching chunks are scanned.
+    """
+    db = store.get_vectorstore(persist_dir)
+    bm25 = lexical.get_index(persist_dir) if hybrid else None
+    if bm25 is None or len(bm25) == 0:
+        if hybrid:
+            print("⚠️ BM25 index not found, using dense retrieval only")
+        return _to_documents(*_dense_search(db, query, k, embedding, where))
+
+    ids, texts, metadatas = _dense_search(db, query, FUSION_CANDIDATES, embedding, where)
+    dense = {chunk_id: (text, meta) for chunk_id, text, meta in zip(ids, texts, metadatas)}
+    with metrics.span("retrieve.bm25"):
+        lexical_ids = [chunk_id for chunk_id, _ in bm25.search(query, k=FUSION_CANDIDATES, where=where)]
+
+    fused = lexical.reciprocal_rank_fusion([ids, lexical_ids])[:k]
+
+    # Fetch the text of chunks that only the lexical index returned
+    missing = [chunk_id for chunk_id in fused if chunk_id not in dense]
+    if missing:
+        with metrics.span("retrieve.fetch") as span:
+            span["chunks"] = len(missing)
+            results = db._collection.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, text, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+            dense[chunk_id] = (text, meta)
+
+    fused = [chunk_id for chunk_id in fused if chunk_id in dense]
+    return _to_documents(
+        fused,
+        [dense[chunk_id][0] for chunk_id in fused],
+        [dense[chunk_id][1] for chunk_id in fused]
+    )
+
+def _prepare_answer(query, persist_dir, k, hybrid, use_cache, rerank=None, where=None, embedding=None):
+    """Run the retrieval half of a question.
+
+    With ``rerank`` (default: the RERANK env var) a wider candidate pool is
+    retrieved and rescored by the cross-encoder, and only the best ``k``
+    (default ``RERANK_TOP_K``) chunks go into the prompt. ``where`` restricts
+    retrieval to matching chunks (see ``section_filter``). A precomputed
+    query ``embedding`` skips embedding the question again.
+
+    Returns ``(answer, None)`` when the question can be answered without the
+    LLM (an error message or a cached answer), otherwise ``(None, state)``
+    with the retrieved docs, the prompt inputs and the cache key parts.
+    """
+    if get_llm() is None:
+        return "❌ Ollama not initialized. Please run `ollama run gemma:2b`.", None
 
     if not os.path.exists(persist_dir):
-        return "❌ No vector DB found. Please embed some documents first."
+        return "❌ No vector DB found. Please embed some documents first.", None
+
+    db = store.get_vectorstore(persist_dir)
 
     try:
-        db = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings,
-            collection_name="document_embeddings"
+        collection = db._collection
+        count = collection.count()
+        if count == 0:
+            return "⚠️ No documents found in the database.", None
+    except Exception as e:
+        print(f"⚠️ Failed to fetch collection count: {e}")
+
+    if rerank is None:
+        rerank = reranking.RERANK_ENABLED
+    if k is None:
+        k = reranking.RERANK_TOP_K if rerank else (HYBRID_K if hybrid else DENSE_K)
+
+    # Serve repeated and near-duplicate questions from the answer cache
+    if embedding is None:
+        with metrics.span("query.embed"):
+            embedding = store.get_embeddings().embed_query(query)
+    scope = (os.path.abspath(persist_dir), k, hybrid, rerank, json.dumps(where, sort_keys=True))
+    version = store.index_version(persist_dir)
+    if use_cache:
+        cached = answer_cache.get(scope, query, embedding, version)
+        metrics.inc("rag_answer_cache_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            print("⚡ Answer served from cache")
+            return cached, None
+
+    candidates = max(k, reranking.RERANK_CANDIDATES) if rerank else k
+    with metrics.span("query.retrieve", hybrid=hybrid):
+        docs = retrieve(query, persist_dir, k=candidates, hybrid=hybrid, embedding=embedding, where=where)
+    metrics.observe("rag_retrieved_chunks", len(docs), buckets=metrics.SIZE_BUCKETS)
+
+    if rerank and docs:
+        with metrics.span("query.rerank") as span:
+            span["candidates"] = len(docs)
+            docs = reranking.get_reranker().rerank(query, docs, top_k=k)
+
+    if not docs:
+        return "⚠️ No relevant documents found.", None
+
+    # Merge adjacent chunks, drop near-duplicates and pack into the token budget
+    with metrics.span("query.context") as span:
+        docs, context = context_builder.assemble_context(
+            docs,
+            budget_tokens=CONTEXT_TOKEN_BUDGET,
+            query_embedding=embedding,
+            embeddings=store.get_embeddings(),
+            mmr_lambda=CONTEXT_MMR_LAMBDA
         )
+        prompt_tokens = context_builder.estimate_tokens(PROMPT_TEMPLATE + context + query)
+        span.update(blocks=len(docs), prompt_tokens=prompt_tokens)
+    metrics.observe("rag_prompt_tokens", prompt_tokens, buckets=metrics.SIZE_BUCKETS)
+
+    return None, {
+        "docs": docs,
+        "prompt": PROMPT_TEMPLATE.format(context=context, question=query),
+        "cache_key": (scope, query, embedding, version),
+    }
+
+def ask_question(query, persist_dir="data/chroma_store", k=None, hybrid=True, use_cache=True, rerank=None,
+                 where=None):
+    try:
+        answer, state = _prepare_answer(query, persist_dir, k, hybrid, use_cache, rerank, where)
+        if state is None:
+            return answer
+
+        # Ask LLM
+        with metrics.span("llm.generate", model=LLM_MODEL):
+            answer = llm_gateway.generate(LLM_MODEL, state["prompt"], client=get_llm()).strip()
+
+        if use_cache:
+            answer_cache.put(*state["cache_key"], answer)
+        return answer
 
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return f"❌ Error processing query: {e}"
+
+async def aask_question(query, persist_dir="data/chroma_store", k=None, hybrid=True, use_cache=True, rerank=None,
+                        where=None):
+    """Async ask_question: retrieval runs in a worker thread and the LLM call
+    goes through the async Ollama client, so the event loop is never blocked.
+
+    Raises ``llm_gateway.LLMOverloaded`` when the LLM queue rejects the call,
+    so the API can answer 503 instead of returning the error as an answer.
+    """
+    try:
+        answer, state = await asyncio.to_thread(_prepare_answer, query, persist_dir, k, hybrid, use_cache, rerank, where)
+        if state is None:
+            return answer
+
+        with metrics.span("llm.generate", model=LLM_MODEL):
+            answer = (await llm_gateway.agenerate(LLM_MODEL, state["prompt"], client=get_llm())).strip()
+
+        if use_cache:
+            answer_cache.put(*state["cache_key"], answer)
+        return answer
+
+    except llm_gateway.LLMOverloaded:
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return f"❌ Error processing query: {e}"
+
+def overloaded_event(error):
+    """Stream event for a call the LLM gateway rejected; clients should retry later"""
+    return {"type": "overloaded", "message": f"⏳ {error}", "retry_after": llm_gateway.RETRY_AFTER_SECONDS}
+
+def source_filter(source, where=None):
+    """``where`` narrowed to the chunks of one source file"""
+    if not where:
+        return {"source": source}
+    return {"$and": [{"source": source}, where]}
+
+async def astream_questions_batch(questions, sources=None, persist_dir="data/chroma_store", k=None, hybrid=True,
+                                  use_cache=True, rerank=None, where=None, concurrency=BATCH_CONCURRENCY):
+    """Answer every question about every source, yielding results as they finish.
+
+    All questions are embedded in one model batch. Each (question, source)
+    pair is retrieved separately with a ``source`` filter (combined with
+    ``where``), so every answer only sees that document; ``sources=None``
+    means every source in the index, and ``sources=[]`` asks each question
+    once over the whole index. At most ``concurrency`` retrievals (in worker
+    threads) and ``concurrency`` LLM calls run at once.
+
+    Yields ``{"type": "result", "question_index", "question", "source",
+    "answer", "cached", "ms"}`` per pair, in completion order (or an
+    ``"overloaded"`` event with the same keys minus the answer when the LLM
+    gateway rejected that pair), then
+    ``{"type": "done", "results": ..., "ms": ...}``. Failures of the whole
+    batch are reported as ``{"type": "error", "message": ...}``.
+    """
+    started = time.perf_counter()
+    if get_llm() is None:
+        yield {"type": "error", "message": "❌ Ollama not initialized. Please run `ollama run gemma:2b`."}
+        return
+    if not os.path.exists(persist_dir):
+        yield {"type": "error", "message": "❌ No vector DB found. Please embed some documents first."}
+        return
+
+    questions = list(questions)
+    indices = [i for i, question in enumerate(questions) if question and question.strip()]
+    if sources is None:
+        sources = await asyncio.to_thread(store.list_sources, persist_dir)
+    scopes = [(source, source_filter(source, where)) for source in sources] or [(None, where)]
+    if not indices:
+        yield {"type": "done", "results": 0, "ms": 0.0}
+        return
+
+    try:
+        with metrics.span("query.embed_batch") as span:
+            span["questions"] = len(indices)
+            vectors = await asyncio.to_thread(store.get_embeddings().embed_documents, [questions[i] for i in indices])
+        embeddings = dict(zip(indices, vectors))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield {"type": "error", "message": f"❌ Error embedding questions: {e}"}
+        return
+
+    retrieval_slots = asyncio.Semaphore(max(1, concurrency))
+    llm_slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(index, source, pair_where):
+        pair_started = time.perf_counter()
+        question = questions[index]
+        cached = False
         try:
-            collection = db._collection
-            count = collection.count()
-            if count == 0:
-                return "⚠️ No documents found in the database."
+            async with retrieval_slots:
+                answer, state = await asyncio.to_thread(
+                    _prepare_answer, question, persist_dir, k, hybrid, use_cache, rerank, pair_where, embeddings[index])
+            if state is None:
+                cached = not answer.startswith(("❌", "⚠️"))
+            else:
+                async with llm_slots:
+                    with metrics.span("llm.generate", model=LLM_MODEL):
+                        answer = (await llm_gateway.agenerate(LLM_MODEL, state["prompt"], client=get_llm())).strip()
+                if use_cache:
+                    answer_cache.put(*state["cache_key"], answer)
+        except llm_gateway.LLMOverloaded as e:
+            return dict(overloaded_event(e), question_index=index, question=question, source=source)
         except Exception as e:
-            print(f"⚠️ Failed to fetch collection count: {e}")
+            import traceback
+            traceback.print_exc()
+            answer = f"❌ Error processing query: {e}"
+        return {
+            "type": "result",
+            "question_index": index,
+            "question": question,
+            "source": source,
+            "answer": answer,
+            "cached": cached,
+            "ms": round((time.perf_counter() - pair_started) * 1000, 2),
+        }
+
+    tasks = [
+        asyncio.ensure_future(answer(index, source, pair_where))
+        for source, pair_where in scopes
+        for index in indices
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # The client went away or the caller stopped early
+        for task in tasks:
+            task.cancel()
+
+    yield {"type": "done", "results": len(tasks), "ms": round((time.perf_counter() - started) * 1000, 2)}
+
+def ask_questions_batch(questions, sources=None, persist_dir="data/chroma_store", k=None, hybrid=True,
+                        use_cache=True, rerank=None, where=None, concurrency=BATCH_CONCURRENCY):
+    """Blocking astream_questions_batch: returns the results ordered by source, then question.
+
+    Pairs the LLM gateway rejected are included as ``"overloaded"`` events.
+    Raises RuntimeError if the batch as a whole fails (no LLM, no index).
+    """
+    async def collect():
+        return [event async for event in astream_questions_batch(
+            questions, sources, persist_dir, k, hybrid, use_cache, rerank, where, concurrency)]
+
+    events = asyncio.run(collect())
+    for event in events:
+        if event["type"] == "error":
+            raise RuntimeError(event["message"])
+    order = {source: i for i, source in enumerate(sources or [])}
+    results = [event for event in events if event["type"] in ("result", "overloaded")]
+    results.sort(key=lambda r: (order.get(r["source"], len(order)), r["source"] or "", r["question_index"]))
+    return results
+
+def describe_sources(docs):
+    """Short, JSON-serializable description of retrieved chunks"""
+    return [
+        {
+            "id": doc.metadata.get("id"),
+            "source": doc.metadata.get("source"),
+            "preview": doc.page_content[:200],
+        }
+        for doc in docs
+    ]
+
+def stream_answer(query, persist_dir="data/chroma_store", k=None, hybrid=True, use_cache=True, rerank=None,
+                  where=None):
+    """Answer a question, yielding events as soon as they are available.
+
+    Yields ``{"type": "sources", "sources": [...]}`` once retrieval is done,
+    then ``{"type": "token", "text": ...}`` for every LLM token, and finally
+    ``{"type": "done", "answer": ..., "cached": bool}``. Failures are reported
+    as ``{"type": "error", "message": ...}``, and a call the LLM gateway
+    rejected as ``{"type": "overloaded", "message": ..., "retry_after": ...}``.
+    """
+    try:
+        answer, state = _prepare_answer(query, persist_dir, k, hybrid, use_cache, rerank, where)
+        if state is None:
+            if answer.startswith(("❌", "⚠️")):
+                yield {"type": "error", "message": answer}
+            else:
+                yield {"type": "token", "text": answer}
+                yield {"type": "done", "answer": answer, "cached": True}
+            return
 
-        # Retrieve more chunks for full skill coverage
-        docs = db.similarity_search(query, k=12)
+        yield {"type": "sources", "sources": describe_sources(state["docs"])}
 
-        if not docs:
-            return "⚠️ No relevant documents found."
+        parts = []
+        with metrics.span("llm.stream", model=LLM_MODEL):
+            started = time.perf_counter()
+            for token in llm_gateway.stream(LLM_MODEL, state["prompt"], client=get_llm()):
+                if not parts:
+                    metrics.observe("rag_llm_first_token_seconds", time.perf_counter() - started, model=LLM_MODEL)
+                parts.append(token)
+                yield {"type": "token", "text": token}
 
-        # Prepare full context
-        context = "\n".join([doc.page_content for doc in docs])
+        answer = "".join(parts).strip()
+        if use_cache:
+            answer_cache.put(*state["cache_key"], answer)
+        yield {"type": "done", "answer": answer, "cached": False}
 
-        # Ask LLM
-        response = chain.invoke({"context": context, "question": query})
+    except llm_gateway.LLMOverloaded as e:
+        yield overloaded_event(e)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield {"type": "error", "message": f"❌ Error processing query: {e}"}
+
+async def astream_answer(query, persist_dir="data/chroma_store", k=None, hybrid=True, use_cache=True, rerank=None,
+                         where=None):
+    """Async version of stream_answer using the async Ollama client"""
+    try:
+        answer, state = await asyncio.to_thread(_prepare_answer, query, persist_dir, k, hybrid, use_cache, rerank, where)
+        if state is None:
+            if answer.startswith(("❌", "⚠️")):
+                yield {"type": "error", "message": answer}
+            else:
+                yield {"type": "token", "text": answer}
+                yield {"type": "done", "answer": answer, "cached": True}
+            return
+
+        yield {"type": "sources", "sources": describe_sources(state["docs"])}
+
+        parts = []
+        with metrics.span("llm.stream", model=LLM_MODEL):
+            started = time.perf_counter()
+            async for token in llm_gateway.astream(LLM_MODEL, state["prompt"], client=get_llm()):
+                if not parts:
+                    metrics.observe("rag_llm_first_token_seconds", time.perf_counter() - started, model=LLM_MODEL)
+                parts.append(token)
+                yield {"type": "token", "text": token}
 
-        return response.strip() if isinstance(response, str) else str(response)
+        answer = "".join(parts).strip()
+        if use_cache:
+            answer_cache.put(*state["cache_key"], answer)
+        yield {"type": "done", "answer": answer, "cached": False}
 
+    except llm_gateway.LLMOverloaded as e:
+        yield overloaded_event(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return f"❌ Error processing query: {e}"
+        yield {"type": "error", "message": f"❌ Error processing query: {e}"}
 
 def get_relevant_documents(query, persist_dir="data/chroma_store", k=6):
     try:
@@ -100,11 +533,7 @@ def get_relevant_documents(query, persist_dir="data/chroma_store", k=6):
             print("⚠️ No persist directory.")
             return []
 
-        db = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings,
-            collection_name="document_embeddings"
-        )
+        db = store.get_vectorstore(persist_dir)
 
         collection = db._collection
         if collection.count() == 0:
@@ -126,11 +555,7 @@ def debug_database_contents(persist_dir="data/chroma_store"):
             return
 
         print(f"Contents of {persist_dir}: {os.listdir(persist_dir)}")
-        db = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings,
-            collection_name="document_embeddings"
-        )
+        db = store.get_vectorstore(persist_dir)
 
         collection = db._collection
         count = collection.count()
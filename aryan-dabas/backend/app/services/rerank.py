@@ -0,0 +1,113 @@
+"""Optional cross-encoder reranking of retrieved chunks.
+
+A wide candidate pool is retrieved cheaply (dense + BM25), rescored jointly
+with the question by a small local cross-encoder, and only the best few
+chunks are sent to the LLM. Scores are cached per (question, chunk) pair, so
+repeated or refined questions over the same chunks skip the model.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+# Small CPU-friendly cross-encoder (about 22M parameters)
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Set RERANK=1 to rerank by default in query.ask_question and friends
+RERANK_ENABLED = os.environ.get("RERANK", "0") == "1"
+# Candidates retrieved for reranking and chunks kept for the prompt
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+RERANK_TOP_K = int(os.environ.get("RERANK_TOP_K", "4"))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "32"))
+# (question, chunk) scores kept in memory
+RERANK_CACHE_SIZE = int(os.environ.get("RERANK_CACHE_SIZE", "20000"))
+
+metrics.describe("rag_rerank_cache_total", "Cross-encoder score cache lookups by result, per candidate")
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class CrossEncoderReranker:
+    """Scores (question, chunk) pairs with a sentence-transformers CrossEncoder"""
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE, cache_size=RERANK_CACHE_SIZE):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            print("Error: sentence-transformers is required for reranking. Try: pip install sentence-transformers")
+            raise
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.model = CrossEncoder(model_name, device="cpu")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def score(self, query, texts):
+        """Relevance score of each text for the query, using cached scores where possible"""
+        query_key = _hash(query)
+        keys = [(query_key, _hash(text)) for text in texts]
+        scores = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in scores:
+                missing.setdefault(key, text)
+        metrics.inc("rag_rerank_cache_total", len(texts) - len(missing), result="hit")
+        metrics.inc("rag_rerank_cache_total", len(missing), result="miss")
+
+        if missing:
+            with metrics.span("rerank.model") as span:
+                span["pairs"] = len(missing)
+                predicted = self.model.predict(
+                    [(query, text) for text in missing.values()],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                )
+            with self._lock:
+                for key, value in zip(missing, predicted):
+                    scores[key] = self._cache[key] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return [scores[key] for key in keys]
+
+    def rerank(self, query, docs, top_k=RERANK_TOP_K):
+        """Return the ``top_k`` best docs, best first, with ``rerank_score`` in their metadata"""
+        if not docs:
+            return []
+        scores = self.score(query, [doc.page_content for doc in docs])
+        ranked = sorted(zip(scores, range(len(docs))), key=lambda pair: pair[0], reverse=True)[:top_k]
+        result = []
+        for score, i in ranked:
+            doc = docs[i]
+            doc.metadata = dict(doc.metadata, rerank_score=round(score, 4))
+            result.append(doc)
+        return result
+
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker():
+    """Return the shared reranker, loading the cross-encoder on first use"""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                with metrics.span("rerank.load"):
+                    _reranker = CrossEncoderReranker()
+                print(f"✓ Cross-encoder reranker loaded ({_reranker.model_name})")
+    return _reranker
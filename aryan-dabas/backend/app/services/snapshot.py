@@ -0,0 +1,479 @@
+"""Memory-mapped, read-only snapshots of a vector index.
+
+A snapshot is one self-contained directory that can be copied between hosts:
+
+    snapshot.json      format, embedding model, row count, metadata columns
+    vectors.npy        float32 matrix [rows, dim], L2-normalized, rows sorted by chunk id
+    ids.bin, texts.bin chunk ids and texts as concatenated UTF-8 ...
+    ids.npy, texts.npy ... with their int64 offsets
+    metadata.npy       int32 [rows, columns] codes into the column values of snapshot.json (-1 = missing)
+    manifest.json      the index manifest (files, chunk hashes, index version)
+    bm25.json          the lexical index, restored by ``import``
+    bm25_*.npy, bm25_terms.bin
+                       the same postings as CSR arrays over the rows (terms, indptr, rows, tfs, lengths)
+
+The arrays are opened as read-only numpy memmaps, so opening a snapshot only
+reads the small JSON files and every worker process on a host shares one copy
+of the vectors and of the BM25 postings through the page cache. Dense search is a brute-force dot
+product over the memmap, with ``where`` filters evaluated on the metadata
+codes. Point ``SNAPSHOT_ROOT`` at a directory of snapshots (one per workspace)
+to run a read-only query replica without Chroma or a rebuild.
+
+    python backend/app/services/snapshot.py export data/snapshots/default
+    python backend/app/services/snapshot.py import data/snapshots/default --workspace staging
+"""
+import bisect
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from . import lexical, metrics, store
+except ImportError:
+    import lexical
+    import metrics
+    import store
+
+SNAPSHOT_FORMAT = 1
+# Rows read from Chroma per request while exporting
+EXPORT_BATCH_SIZE = 5000
+# ``where`` filters whose row masks are kept per open snapshot
+MASK_CACHE_SIZE = 64
+
+
+class _Strings:
+    """Read-only sequence of strings stored as UTF-8 bytes plus offsets"""
+
+    def __init__(self, path, name):
+        self.offsets = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        size = int(self.offsets[-1])
+        # np.memmap cannot map an empty file
+        self.data = np.memmap(os.path.join(path, f"{name}.bin"), dtype=np.uint8, mode="r") if size else b""
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.data[start:end]).decode("utf-8")
+
+
+def _write_strings(path, name, strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(os.path.join(path, f"{name}.bin"), "wb") as f:
+        for b in encoded:
+            f.write(b)
+    np.save(os.path.join(path, f"{name}.npy"), offsets)
+
+
+def _value_key(value):
+    # Keep 1, 1.0 and True apart when dictionary-encoding metadata values
+    return type(value).__name__, value
+
+
+class SnapshotIndex:
+    """A snapshot opened for search.
+
+    Mirrors the part of the Chroma collection and vector store API that the
+    services use (``count``, ``query``, ``get`` through ``_collection``, plus
+    ``similarity_search`` and ``as_retriever``), so a snapshot directory can
+    be used anywhere a persist directory is expected.
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, store.SNAPSHOT_FILE), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {info.get('format')!r} in {path}")
+        if info.get("embedding_model") != store.EMBEDDING_MODEL_NAME:
+            raise ValueError(f"Snapshot {path} was built with {info.get('embedding_model')}, "
+                             f"not {store.EMBEDDING_MODEL_NAME}")
+        self.path = path
+        self.info = info
+        self.rows = info["rows"]
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        self.codes = np.load(os.path.join(path, "metadata.npy"), mmap_mode="r")
+        self.ids = _Strings(path, "ids")
+        self.texts = _Strings(path, "texts")
+        self.columns = [(column["key"], column["values"]) for column in info["columns"]]
+        self._column_of = {key: i for i, (key, _) in enumerate(self.columns)}
+        self._masks = OrderedDict()
+        self._masks_lock = threading.Lock()
+        # Snapshots exported before the BM25 arrays existed fall back to bm25.json
+        self.bm25 = SnapshotBM25(self, info["bm25"]) if info.get("bm25") else None
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def _collection(self):
+        return self
+
+    def count(self):
+        return self.rows
+
+    def metadata(self, row):
+        codes = self.codes[row]
+        return {key: values[code] for (key, values), code in zip(self.columns, codes.tolist()) if code >= 0}
+
+    def _column_mask(self, key, condition):
+        column = self._column_of.get(key)
+        values = self.columns[column][1] if column is not None else []
+        # One lookup per distinct value; index -1 (missing) maps to the last entry
+        lut = np.array(
+            [lexical.matches({key: value}, {key: condition}) for value in values]
+            + [lexical.matches({}, {key: condition})],
+            dtype=bool,
+        )
+        if column is None:
+            return np.full(self.rows, lut[-1])
+        return lut[self.codes[:, column]]
+
+    def _build_mask(self, where):
+        mask = np.ones(self.rows, dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for clause in condition:
+                    mask &= self._build_mask(clause)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._build_mask(clause) for clause in condition])
+            else:
+                mask &= self._column_mask(key, condition)
+        return mask
+
+    def mask(self, where):
+        """Boolean row mask of a Chroma-style ``where`` filter (cached)"""
+        key = json.dumps(where, sort_keys=True)
+        with self._masks_lock:
+            if key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+        mask = self._build_mask(where)
+        with self._masks_lock:
+            self._masks[key] = mask
+            while len(self._masks) > MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return mask
+
+    def search(self, embedding, k, where=None):
+        """Rows and cosine similarities of the ``k`` nearest vectors, best first"""
+        if not self.rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if where:
+            rows = np.flatnonzero(self.mask(where))
+            scores = self.vectors[rows] @ query
+        else:
+            rows = None
+            scores = self.vectors @ query
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return (rows[top] if rows is not None else top), scores[top]
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas")):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for embedding in query_embeddings:
+            with metrics.span("snapshot.search") as span:
+                span["rows"] = self.rows
+                rows, scores = self.search(embedding, n_results, where)
+            result["ids"].append([self.ids[row] for row in rows])
+            result["documents"].append([self.texts[row] for row in rows] if "documents" in include else None)
+            result["metadatas"].append([self.metadata(row) for row in rows] if "metadatas" in include else None)
+            result["distances"].append([float(1 - score) for score in scores])
+        return result
+
+    def _row(self, chunk_id):
+        # Rows are sorted by id, so lookups are a binary search over the memmapped ids
+        row = bisect.bisect_left(self.ids, chunk_id)
+        return row if row < self.rows and self.ids[row] == chunk_id else None
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        if ids is None:
+            rows = range(self.rows)
+        else:
+            rows = [row for row in map(self._row, ids) if row is not None]
+        if where:
+            mask = self.mask(where)
+            rows = [row for row in rows if mask[row]]
+        start = offset or 0
+        rows = rows[start:start + limit if limit is not None else None]
+        result = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.texts[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadata(row) for row in rows]
+        if "embeddings" in include:
+            result["embeddings"] = np.asarray(self.vectors[list(rows)])
+        return result
+
+    def similarity_search(self, query, k=4, filter=None):
+        from langchain_core.documents import Document
+
+        embedding = store.get_embeddings().embed_query(query)
+        rows, _ = self.search(embedding, k, filter)
+        return [Document(page_content=self.texts[row], metadata=self.metadata(row)) for row in rows]
+
+    def as_retriever(self, search_kwargs=None):
+        """Runnable retriever over ``similarity_search``, like Chroma's ``as_retriever``"""
+        from langchain_core.runnables import RunnableLambda
+
+        search_kwargs = dict(search_kwargs or {})
+        return RunnableLambda(lambda query: self.similarity_search(query, **search_kwargs))
+
+
+class SnapshotBM25:
+    """BM25 postings of a snapshot as memory-mapped CSR arrays.
+
+    Searched like ``lexical.BM25Index``, but every worker shares the same
+    page cache instead of parsing ``bm25.json`` into its own dictionaries.
+    ``where`` filters use the snapshot's metadata masks.
+    """
+
+    def __init__(self, index, info):
+        self.index = index
+        self.k1 = info["k1"]
+        self.b = info["b"]
+        self.docs = info["docs"]
+        self.avg_length = info["total_length"] / self.docs if self.docs else 1.0
+        self.terms = _Strings(index.path, "bm25_terms")
+        self.indptr = np.load(os.path.join(index.path, "bm25_indptr.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(index.path, "bm25_rows.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(index.path, "bm25_tfs.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(index.path, "bm25_lengths.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.docs
+
+    def _term(self, term):
+        i = bisect.bisect_left(self.terms, term)
+        return i if i < len(self.terms) and self.terms[i] == term else None
+
+    def search(self, query, k=10, where=None):
+        """Return up to ``k`` ``(chunk_id, score)`` pairs, best first"""
+        if not self.docs:
+            return []
+        scores = np.zeros(self.index.rows, dtype=np.float64)
+        hit = np.zeros(self.index.rows, dtype=bool)
+        for term in set(lexical.tokenize(query)):
+            i = self._term(term)
+            if i is None:
+                continue
+            start, end = int(self.indptr[i]), int(self.indptr[i + 1])
+            rows = np.asarray(self.rows[start:end])
+            tf = np.asarray(self.tfs[start:end], dtype=np.float64)
+            idf = math.log(1 + (self.docs - (end - start) + 0.5) / (end - start + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * self.lengths[rows] / self.avg_length)
+            scores[rows] += idf * tf * (self.k1 + 1) / norm
+            hit[rows] = True
+
+        if where:
+            hit &= self.index.mask(where)
+        rows = np.flatnonzero(hit)
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(self.index.ids[row], float(scores[row])) for row in rows]
+
+
+def _write_bm25(path, bm25, ids):
+    """Write a ``lexical.BM25Index`` as CSR arrays over the snapshot rows; returns its info"""
+    row_of = {chunk_id: row for row, chunk_id in enumerate(ids)}
+    terms, indptr, rows, tfs = [], [0], [], []
+    for term in sorted(bm25.postings):
+        postings = sorted((row_of[chunk_id], tf) for chunk_id, tf in bm25.postings[term].items()
+                          if chunk_id in row_of)
+        if postings:
+            terms.append(term)
+            rows += [row for row, _ in postings]
+            tfs += [tf for _, tf in postings]
+            indptr.append(len(rows))
+
+    lengths = np.zeros(len(ids), dtype=np.int32)
+    for chunk_id, doc in bm25.docs.items():
+        if chunk_id in row_of:
+            lengths[row_of[chunk_id]] = doc["length"]
+    _write_strings(path, "bm25_terms", terms)
+    np.save(os.path.join(path, "bm25_indptr.npy"), np.asarray(indptr, dtype=np.int64))
+    np.save(os.path.join(path, "bm25_rows.npy"), np.asarray(rows, dtype=np.int32))
+    np.save(os.path.join(path, "bm25_tfs.npy"), np.asarray(tfs, dtype=np.int32))
+    np.save(os.path.join(path, "bm25_lengths.npy"), lengths)
+    return {
+        "k1": bm25.k1,
+        "b": bm25.b,
+        "docs": sum(chunk_id in row_of for chunk_id in bm25.docs),
+        "total_length": int(lengths.sum()),
+    }
+
+
+def export_snapshot(persist_dir, output_dir, batch_size=EXPORT_BATCH_SIZE):
+    """Write a snapshot of the Chroma index in ``persist_dir`` to ``output_dir``.
+
+    The snapshot is written next to ``output_dir`` and swapped in with a
+    rename, so replicas reading the old snapshot are never left with a half
+    written one. Returns the snapshot info (row count, dimensions, ...).
+    """
+    if store.is_snapshot(persist_dir):
+        raise ValueError(f"{persist_dir} is already a snapshot")
+    manifest_file = store.manifest_path(persist_dir)
+    bm25_file = lexical.index_path(persist_dir)
+    if not os.path.exists(persist_dir):
+        raise FileNotFoundError(f"No vector store at {persist_dir}; embed some documents first")
+
+    started = time.perf_counter()
+    version = store.index_version(persist_dir)
+    collection = store.get_vectorstore(persist_dir)._collection
+    total = collection.count()
+    ids, texts, metadatas, batches = [], [], [], []
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        ids += batch["ids"]
+        texts += [text or "" for text in batch["documents"]]
+        metadatas += [metadata or {} for metadata in batch["metadatas"]]
+        batches.append(np.asarray(batch["embeddings"], dtype=np.float32))
+    if store.index_version(persist_dir) != version or len(ids) != total:
+        raise RuntimeError("The index changed during the export; try again once ingest jobs have finished")
+
+    vectors = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    order = sorted(range(len(ids)), key=ids.__getitem__)
+    vectors = np.ascontiguousarray(vectors[order] / norms[order], dtype=np.float32)
+    ids = [ids[i] for i in order]
+    texts = [texts[i] for i in order]
+    metadatas = [metadatas[i] for i in order]
+
+    # Dictionary-encode every metadata key into one int32 code column
+    keys = sorted({key for metadata in metadatas for key in metadata})
+    columns = []
+    codes = np.full((len(ids), len(keys)), -1, dtype=np.int32)
+    for column, key in enumerate(keys):
+        values, code_of = [], {}
+        for row, metadata in enumerate(metadatas):
+            if key in metadata:
+                value = metadata[key]
+                code = code_of.setdefault(_value_key(value), len(values))
+                if code == len(values):
+                    values.append(value)
+                codes[row, column] = code
+        columns.append({"key": key, "values": values})
+
+    output_dir = os.path.normpath(output_dir)
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "vectors.npy"), vectors)
+    np.save(os.path.join(tmp_dir, "metadata.npy"), codes)
+    _write_strings(tmp_dir, "ids", ids)
+    _write_strings(tmp_dir, "texts", texts)
+    if os.path.exists(manifest_file):
+        shutil.copyfile(manifest_file, os.path.join(tmp_dir, "manifest.json"))
+    bm25_info = None
+    if os.path.exists(bm25_file):
+        # The JSON copy is what import_snapshot restores; replicas search the arrays
+        shutil.copyfile(bm25_file, os.path.join(tmp_dir, "bm25.json"))
+        bm25 = lexical.load_index(persist_dir)
+        if bm25 is not None:
+            bm25_info = _write_bm25(tmp_dir, bm25, ids)
+
+    info = {
+        "format": SNAPSHOT_FORMAT,
+        "embedding_model": store.EMBEDDING_MODEL_NAME,
+        "rows": len(ids),
+        "dim": int(vectors.shape[1]) if len(ids) else 0,
+        "index_version": version,
+        "source": os.path.abspath(persist_dir),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "columns": columns,
+        "bm25": bm25_info,
+    }
+    # Written last: a directory without it is not a snapshot
+    with open(os.path.join(tmp_dir, store.SNAPSHOT_FILE), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+    old_dir = None
+    if os.path.exists(output_dir):
+        old_dir = f"{output_dir}.old-{os.getpid()}"
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    if old_dir:
+        # Processes that still map the old files keep reading them until they reopen
+        shutil.rmtree(old_dir, ignore_errors=True)
+    store.invalidate(output_dir)
+
+    print(f"✅ Exported {len(ids)} chunks to snapshot {output_dir} in {time.perf_counter() - started:.1f}s")
+    return info
+
+
+def import_snapshot(snapshot_dir, persist_dir, batch_size=1024):
+    """Load a snapshot into a fresh, writable Chroma store at ``persist_dir`` without re-embedding"""
+    index = SnapshotIndex(snapshot_dir)
+    started = time.perf_counter()
+    previous_version = store.index_version(persist_dir) or 0
+
+    store.invalidate(persist_dir, reset=True)
+    shutil.rmtree(persist_dir, ignore_errors=True)
+    os.makedirs(persist_dir, exist_ok=True)
+    collection = store.get_vectorstore(persist_dir)._collection
+    for start in range(0, index.rows, batch_size):
+        rows = range(start, min(start + batch_size, index.rows))
+        collection.add(
+            ids=[index.ids[row] for row in rows],
+            embeddings=np.asarray(index.vectors[start:rows.stop]),
+            documents=[index.texts[row] for row in rows],
+            metadatas=[index.metadata(row) for row in rows],
+        )
+
+    bm25_file = os.path.join(snapshot_dir, "bm25.json")
+    if os.path.exists(bm25_file):
+        shutil.copyfile(bm25_file, lexical.index_path(persist_dir))
+    # The manifest goes last; readers reopen the store when it changes
+    manifest_file = os.path.join(snapshot_dir, "manifest.json")
+    manifest = {"files": {}}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    # Count up from both indexes so cached answers of the replaced one never match
+    manifest["index_version"] = max(previous_version, manifest.get("index_version", 0)) + 1
+    path = store.manifest_path(persist_dir)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    store.invalidate(persist_dir)
+
+    print(f"✅ Imported {index.rows} chunks into {persist_dir} in {time.perf_counter() - started:.1f}s")
+    return index.rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    try:
+        from . import workspaces
+    except ImportError:
+        import workspaces
+
+    parser = argparse.ArgumentParser(description="Export or import memory-mapped index snapshots")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("snapshot_dir")
+    parser.add_argument("--workspace", default=workspaces.DEFAULT_WORKSPACE)
+    args = parser.parse_args()
+
+    persist_dir = workspaces.workspace_paths(args.workspace)["persist_dir"]
+    if args.command == "export":
+        export_snapshot(persist_dir, args.snapshot_dir)
+    else:
+        import_snapshot(args.snapshot_dir, persist_dir)
@@ -0,0 +1,272 @@
+"""Process-wide registry for the embedding model and Chroma vector stores"""
+import json
+import os
+import threading
+import weakref
+
+try:
+    from . import metrics
+except ImportError:
+    import metrics
+
+
+def _import_embedding_modules():
+    # Deferred so importing the services does not pull in torch/langchain
+    try:
+        from . import embedder, embedding_cache
+    except ImportError:
+        import embedder
+        import embedding_cache
+    return embedder, embedding_cache
+
+EMBEDDING_MODEL_NAME = "BAAI/bge-small-en"
+COLLECTION_NAME = "document_embeddings"
+# Marker file of a read-only index snapshot directory (see snapshot.py)
+SNAPSHOT_FILE = "snapshot.json"
+
+_lock = threading.RLock()
+_embeddings = None
+# (persist_dir, collection_name) -> (Chroma, manifest mtime when opened)
+_vectorstores = {}
+# manifest path -> (manifest mtime, index version)
+_index_versions = {}
+
+
+def is_snapshot(persist_dir):
+    """True if ``persist_dir`` is a read-only snapshot rather than a Chroma store"""
+    return os.path.isfile(os.path.join(persist_dir, SNAPSHOT_FILE))
+
+
+def manifest_path(persist_dir="data/chroma_store"):
+    """Path of the sidecar manifest kept next to the persist directory (inside a snapshot)"""
+    if is_snapshot(persist_dir):
+        return os.path.join(persist_dir, "manifest.json")
+    return os.path.normpath(persist_dir) + ".manifest.json"
+
+
+def _manifest_mtime(persist_dir):
+    # A re-exported snapshot always rewrites its marker file
+    path = os.path.join(persist_dir, SNAPSHOT_FILE) if is_snapshot(persist_dir) else manifest_path(persist_dir)
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def index_version(persist_dir="data/chroma_store"):
+    """Version counter of the index, bumped by every embed_documents change"""
+    path = manifest_path(persist_dir)
+    mtime = _manifest_mtime(persist_dir)
+    if mtime is None:
+        return None
+
+    cached = _index_versions.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = json.load(f).get("index_version", 0)
+    except Exception as e:
+        print(f"⚠️ Could not read index manifest {path}: {e}")
+        return None
+    _index_versions[path] = (mtime, version)
+    return version
+
+
+def list_sources(persist_dir="data/chroma_store"):
+    """Names of the source files in the index, from its manifest"""
+    try:
+        with open(manifest_path(persist_dir), "r", encoding="utf-8") as f:
+            return sorted(json.load(f).get("files", {}))
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        print(f"⚠️ Could not read index manifest {manifest_path(persist_dir)}: {e}")
+        return []
+
+
+def _embedding_cache_key(model):
+    # int8 ONNX vectors differ slightly from fp32 ones, so they get their own cache
+    backend = model.backend
+    if backend == "onnx-int8":
+        backend = f"{backend}-{model.quantization}"
+    return f"{model.model_name}|normalize={model.normalize}|{backend}"
+
+
+def get_embeddings():
+    """Return the shared BGE embeddings model, loading it on first use.
+
+    The backend, batch size and thread count come from the EMBED_* env vars
+    (see ``embedder.BGEEmbeddings.from_env``). Unless EMBED_CACHE=0, vectors
+    are cached on disk so texts seen before are never embedded again.
+    """
+    global _embeddings
+    if _embeddings is not None:
+        return _embeddings
+
+    with _lock:
+        if _embeddings is None:
+            try:
+                embedder, embedding_cache = _import_embedding_modules()
+                with metrics.span("store.load_embeddings"):
+                    model = embedder.BGEEmbeddings.from_env(EMBEDDING_MODEL_NAME)
+                print(f"✓ BGE embeddings model initialized successfully ({model.backend} backend)")
+                if os.environ.get("EMBED_CACHE", "1") != "0":
+                    model = embedding_cache.CachedEmbeddings(model, embedding_cache.EmbeddingCache(
+                        os.environ.get("EMBED_CACHE_DIR", "data/embedding_cache"),
+                        _embedding_cache_key(model)
+                    ))
+                _embeddings = model
+            except Exception as e:
+                print(f"❌ Error initializing embeddings model: {e}")
+                print("This might be due to missing dependencies. Try:")
+                print("pip install sentence-transformers")
+                raise
+    return _embeddings
+
+
+def get_vectorstore(persist_dir="data/chroma_store", collection_name=COLLECTION_NAME):
+    """Return the shared Chroma store for a persist directory.
+
+    The store is opened once and reused. If another process has rewritten the
+    index since it was opened (the manifest changed on disk), it is reopened.
+    Snapshot directories are opened as a memory-mapped ``SnapshotIndex``.
+    """
+    key = (os.path.abspath(persist_dir), collection_name)
+    mtime = _manifest_mtime(persist_dir)
+    snapshot = is_snapshot(persist_dir)
+
+    with _lock:
+        cached = _vectorstores.get(key)
+        if cached is not None:
+            db, opened_mtime = cached
+            if opened_mtime == mtime:
+                return db
+            print("🔄 Index changed on disk, reopening vector store")
+            # Another process wrote or rebuilt the index: the cached Chroma client
+            # still has the old sqlite handles and HNSW segment, so open a new one
+            invalidate(persist_dir, retire=not snapshot)
+
+        if snapshot:
+            try:
+                from . import snapshot as snapshots
+            except ImportError:
+                import snapshot as snapshots
+            with metrics.span("store.open_snapshot"):
+                db = snapshots.SnapshotIndex(persist_dir)
+            _vectorstores[key] = (db, mtime)
+            return db
+
+        from langchain_chroma import Chroma
+        embeddings = get_embeddings()
+        with metrics.span("store.open_vectorstore"):
+            db = Chroma(
+                persist_directory=persist_dir,
+                embedding_function=embeddings,
+                collection_name=collection_name
+            )
+        _vectorstores[key] = (db, mtime)
+        return db
+
+
+def _retire_clients(path, stores):
+    """Detach the cached Chroma clients of ``path``; stop them once ``stores`` are gone"""
+    from chromadb.api.client import SharedSystemClient
+
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if systems is None:
+        SharedSystemClient.clear_system_cache()
+        return
+    retired = [systems.pop(i) for i in list(systems) if i and os.path.abspath(i) == path]
+    if not retired:
+        return
+
+    users = [len(stores)]
+    users_lock = threading.Lock()
+
+    def release():
+        with users_lock:
+            users[0] -= 1
+            if users[0] > 0:
+                return
+        for system in retired:
+            system.stop()
+
+    if not stores:
+        users[0] = 1
+        release()
+    # In-flight requests hold the old stores; the last one to let go stops the client
+    for db in stores:
+        weakref.finalize(db, release)
+
+
+def _release_clients(path=None):
+    """Stop the cached Chroma clients for ``path`` (all clients if None)"""
+    from chromadb.api.client import SharedSystemClient
+
+    systems = getattr(SharedSystemClient, "_identifier_to_system", None)
+    if path is None or systems is None:
+        SharedSystemClient.clear_system_cache()
+        return
+    # Clients are cached by the persist directory string they were opened with
+    for identifier in [i for i in systems if i and os.path.abspath(i) == path]:
+        systems.pop(identifier).stop()
+
+
+def invalidate(persist_dir=None, reset=False, retire=False):
+    """Drop cached vector stores for ``persist_dir`` (all of them if None).
+
+    With ``reset`` the underlying Chroma clients are released as well, which
+    is required before the persist directory is deleted or replaced. With
+    ``retire`` they are detached instead, so the next open gets a fresh client
+    while requests still holding the old stores finish on the old one. Stores
+    of other persist directories (other workspaces) are left open.
+    """
+    path = os.path.abspath(persist_dir) if persist_dir is not None else None
+    with _lock:
+        dropped = [_vectorstores.pop(key)[0] for key in [k for k in _vectorstores if path is None or k[0] == path]]
+
+        if reset:
+            try:
+                _release_clients(path)
+            except Exception as e:
+                print(f"⚠️ Could not reset Chroma client cache: {e}")
+        elif retire and path is not None:
+            try:
+                _retire_clients(path, dropped)
+            except Exception as e:
+                print(f"⚠️ Could not detach Chroma client: {e}")
+
+
+_REBUILD_SCRIPT = """
+import json, shutil, sys
+sys.path.insert(0, sys.argv[1])
+import store
+persist_dir, text, version = sys.argv[2], sys.argv[3], int(sys.argv[4])
+store.invalidate(persist_dir, reset=True)
+shutil.rmtree(persist_dir, ignore_errors=True)
+store.get_vectorstore(persist_dir)._collection.add(ids=[text], embeddings=[[1.0, 0.0]], documents=[text])
+with open(store.manifest_path(persist_dir), "w", encoding="utf-8") as f:
+    json.dump({"index_version": version}, f)
+"""
+
+
+def test_cross_process_reopen():
+    """Rebuild a store in another process and check this process queries the new one"""
+    import subprocess
+    import sys
+    import tempfile
+
+    print("🔧 Testing cross-process index reopen...")
+    persist_dir = os.path.join(tempfile.mkdtemp(), "chroma_store")
+    services_dir = os.path.dirname(os.path.abspath(__file__))
+    for version, text in enumerate(["alpha", "beta"], start=1):
+        subprocess.run([sys.executable, "-c", _REBUILD_SCRIPT, services_dir, persist_dir, text, str(version)],
+                       check=True)
+        result = get_vectorstore(persist_dir)._collection.query(query_embeddings=[[1.0, 0.0]], n_results=2)
+        ok = result["documents"][0] == [text]
+        print("✓" if ok else "✗", f"index v{version}: expected [{text!r}], got {result['documents'][0]}")
+
+
+if __name__ == "__main__":
+    test_cross_process_reopen()
@@ -1,18 +1,232 @@
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-llm = OllamaLLM(model="mistral:7b-instruct", temperature=0.2)
+try:
+    from . import embed, llm_gateway, metrics
+except ImportError:
+    import embed
+    import llm_gateway
+    import metrics
 
-prompt = PromptTemplate.from_template(
-    """You are an expert summarizer. Read the following document and return a short, clear summary of its main theme.
+SUMMARY_MODEL = "mistral:7b-instruct"
+# Bump when the prompts change so cached summaries are regenerated
+PROMPT_VERSION = 1
+
+PROMPT_TEMPLATE = """You are an expert summarizer. Read the following document and return a short, clear summary of its main theme.
 
 Document:
 {text}
 
 Theme Summary:"""
-)
 
-summarizer = prompt | llm
+REDUCE_PROMPT_TEMPLATE = """You are an expert summarizer. Below are summaries of several documents. Identify the common themes across them and return a short, clear summary of the overall theme.
+
+Summaries:
+{text}
+
+Overall Theme Summary:"""
+
+# Built on first use so importing this module does not load langchain or contact Ollama
+_chains = {}
+_chains_lock = threading.Lock()
+
+
+def _get_chains():
+    with _chains_lock:
+        if not _chains:
+            from langchain_core.prompts import PromptTemplate
+
+            llm = llm_gateway.get_client(SUMMARY_MODEL, temperature=0.2)
+            _chains["llm"] = llm
+            _chains["summarizer"] = PromptTemplate.from_template(PROMPT_TEMPLATE) | llm
+            _chains["reducer"] = PromptTemplate.from_template(REDUCE_PROMPT_TEMPLATE) | llm
+        return _chains
+
+
+def get_llm():
+    return _get_chains()["llm"]
+
+
+def __getattr__(name):
+    # Keep ``summarize.llm`` / ``summarizer`` / ``reducer`` working without building them at import
+    if name in ("llm", "summarizer", "reducer"):
+        return _get_chains()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Largest piece of text sent in one LLM call (keeps prompts inside the context window)
+MAX_CHARS_PER_CALL = 6000
+# Parallel map calls; the LLM gateway decides how many reach Ollama at once
+SUMMARY_WORKERS = int(os.environ.get("SUMMARY_WORKERS", "4"))
+
+# Summaries persist here (next to data/text_outputs) across sessions and processes
+SUMMARY_CACHE_DIR = os.environ.get("SUMMARY_CACHE_DIR", "data/summaries")
+
+metrics.describe("rag_summary_cache_total", "Summary cache lookups by kind and result")
+
+_summary_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cache_path(kind, content_hash):
+    key = _content_hash(f"{SUMMARY_MODEL}|{PROMPT_VERSION}|{kind}|{content_hash}")
+    return os.path.join(SUMMARY_CACHE_DIR, f"{kind}-{key[:32]}.json")
+
+
+def load_cached_summary(kind, content_hash):
+    """Return a stored summary for this content, model and prompt version, or None"""
+    path = _cache_path(kind, content_hash)
+    with _cache_lock:
+        if path in _summary_cache:
+            metrics.inc("rag_summary_cache_total", kind=kind, result="hit")
+            return _summary_cache[path]
+    if not os.path.exists(path):
+        metrics.inc("rag_summary_cache_total", kind=kind, result="miss")
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+    except Exception as e:
+        print(f"⚠️ Could not read cached summary {path}: {e}")
+        metrics.inc("rag_summary_cache_total", kind=kind, result="miss")
+        return None
+    with _cache_lock:
+        _summary_cache[path] = summary
+    metrics.inc("rag_summary_cache_total", kind=kind, result="hit")
+    return summary
+
+
+def save_cached_summary(kind, content_hash, summary, source=None):
+    """Persist a summary atomically"""
+    path = _cache_path(kind, content_hash)
+    os.makedirs(SUMMARY_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "summary": summary,
+            "kind": kind,
+            "source": source,
+            "model": SUMMARY_MODEL,
+            "prompt_version": PROMPT_VERSION,
+            "created_at": time.time(),
+        }, f, indent=2)
+    os.replace(tmp_path, path)
+    with _cache_lock:
+        _summary_cache[path] = summary
+
 
 def get_theme_summary(text):
-    return summarizer.invoke({"text": text}).strip()
\ No newline at end of file
+    with metrics.span("llm.generate", model=SUMMARY_MODEL):
+        return _generate(PROMPT_TEMPLATE.format(text=text))
+
+
+def _split(text):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=MAX_CHARS_PER_CALL,
+        chunk_overlap=0,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    return splitter.split_text(text)
+
+
+def _generate(prompt):
+    """One summary call through the shared LLM gateway"""
+    return llm_gateway.generate(SUMMARY_MODEL, prompt, client=get_llm()).strip()
+
+
+def _reduce(summaries):
+    """Combine summaries, reducing in groups until they fit in one call"""
+    while True:
+        joined = "\n\n".join(f"- {s}" for s in summaries)
+        if len(joined) <= MAX_CHARS_PER_CALL or len(summaries) <= 1:
+            with metrics.span("summarize.reduce", model=SUMMARY_MODEL):
+                return _generate(REDUCE_PROMPT_TEMPLATE.format(text=joined))
+
+        groups, current = [], []
+        for summary in summaries:
+            if current and len("\n\n".join(current + [summary])) > MAX_CHARS_PER_CALL:
+                groups.append(current)
+                current = []
+            current.append(summary)
+        groups.append(current)
+        with metrics.span("summarize.reduce", model=SUMMARY_MODEL):
+            summaries = [_generate(REDUCE_PROMPT_TEMPLATE.format(text="\n\n".join(f"- {s}" for s in group)))
+                         for group in groups]
+
+
+def summarize_document(text, source=None):
+    """Summarize one document, map-reducing over pieces if it is too long.
+
+    Results are cached on disk by the document's content hash.
+    """
+    content_hash = _content_hash(text)
+    cached = load_cached_summary("document", content_hash)
+    if cached is not None:
+        return cached
+
+    pieces = _split(text) if len(text) > MAX_CHARS_PER_CALL else [text]
+    with metrics.span("summarize.document") as span:
+        span["pieces"] = len(pieces)
+        if len(pieces) == 1:
+            summary = get_theme_summary(pieces[0])
+        else:
+            summary = _reduce([get_theme_summary(piece) for piece in pieces])
+
+    save_cached_summary("document", content_hash, summary, source)
+    return summary
+
+
+def summarize_documents(docs, max_workers=SUMMARY_WORKERS):
+    """Map step: summarize each document in parallel, returning {source: summary}"""
+    sources = [doc.metadata.get("source", str(i)) for i, doc in enumerate(docs)]
+    # More threads than LLM slots would only sit in the gateway queue and time out
+    max_workers = max(1, min(max_workers, llm_gateway.gateway.limit(SUMMARY_MODEL)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        summaries = executor.map(summarize_document, [doc.page_content for doc in docs], sources)
+        return dict(zip(sources, summaries))
+
+
+def _corpus_hash(docs):
+    return _content_hash("\n".join(sorted(_content_hash(doc.page_content) for doc in docs)))
+
+
+def get_cached_theme(docs):
+    """Return the stored corpus theme for exactly these documents, without calling the LLM"""
+    if not docs:
+        return None
+    return load_cached_summary("theme", _corpus_hash(docs))
+
+
+def summarize_corpus(docs, max_workers=SUMMARY_WORKERS):
+    """Summarize each document, then reduce the summaries into one corpus theme.
+
+    Both steps are cached, so an unchanged corpus costs no LLM calls and a new
+    document costs one map call plus the reduce.
+    """
+    if not docs:
+        return "⚠️ No documents to summarize."
+    cached = get_cached_theme(docs)
+    if cached is not None:
+        return cached
+
+    summaries = summarize_documents(docs, max_workers=max_workers)
+    if len(summaries) == 1:
+        theme = next(iter(summaries.values()))
+    else:
+        theme = _reduce([summaries[source] for source in sorted(summaries)])
+    save_cached_summary("theme", _corpus_hash(docs), theme)
+    return theme
+
+
+def summarize_theme(text_dir="data/text_outputs"):
+    """Theme summary of every extracted document in ``text_dir``"""
+    return summarize_corpus(embed.load_texts(text_dir))
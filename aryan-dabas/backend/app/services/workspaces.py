@@ -0,0 +1,66 @@
+"""Named workspaces, each with its own uploads, extracted text and vector store.
+
+Every workspace has a separate Chroma persist directory, so its manifest,
+BM25 index, answer-cache scope and ingest jobs are independent: a rebuild or
+ingest in one workspace never touches the files or cached clients of another,
+and searches only cover that workspace's chunks. The "default" workspace
+keeps the original ``data/`` paths.
+
+With ``SNAPSHOT_ROOT`` set, a workspace that has a snapshot at
+``SNAPSHOT_ROOT/<name>`` is served read-only from it (see snapshot.py).
+"""
+import os
+import re
+
+DEFAULT_WORKSPACE = "default"
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", "data/workspaces")
+# Directory of exported index snapshots, one per workspace, for read-only replicas
+SNAPSHOT_ROOT = os.environ.get("SNAPSHOT_ROOT")
+
+NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+_DEFAULT_PATHS = {
+    "input_dir": "data/input_images",
+    "text_dir": "data/text_outputs",
+    "persist_dir": "data/chroma_store",
+}
+
+
+def validate_name(name):
+    """Return the workspace name, or raise ValueError if it is not a safe directory name"""
+    name = (name or DEFAULT_WORKSPACE).strip().lower()
+    if not NAME_RE.match(name):
+        raise ValueError(f"Invalid workspace name {name!r}: use 1-64 lowercase letters, digits, '-' or '_'")
+    return name
+
+
+def workspace_paths(name=DEFAULT_WORKSPACE, create=False):
+    """Return ``{"input_dir", "text_dir", "persist_dir"}`` for a workspace"""
+    name = validate_name(name)
+    if name == DEFAULT_WORKSPACE:
+        paths = dict(_DEFAULT_PATHS)
+    else:
+        root = os.path.join(WORKSPACE_ROOT, name)
+        paths = {
+            "input_dir": os.path.join(root, "input_images"),
+            "text_dir": os.path.join(root, "text_outputs"),
+            "persist_dir": os.path.join(root, "chroma_store"),
+        }
+    if SNAPSHOT_ROOT and os.path.isfile(os.path.join(SNAPSHOT_ROOT, name, "snapshot.json")):
+        paths["persist_dir"] = os.path.join(SNAPSHOT_ROOT, name)
+    if create:
+        os.makedirs(paths["input_dir"], exist_ok=True)
+        os.makedirs(paths["text_dir"], exist_ok=True)
+    return paths
+
+
+def list_workspaces():
+    """Names of all existing workspaces, the default one first"""
+    names = []
+    if os.path.isdir(WORKSPACE_ROOT):
+        names = sorted(
+            entry for entry in os.listdir(WORKSPACE_ROOT)
+            if NAME_RE.match(entry) and entry != DEFAULT_WORKSPACE
+            and os.path.isdir(os.path.join(WORKSPACE_ROOT, entry))
+        )
+    return [DEFAULT_WORKSPACE] + names
@@ -2,9 +2,17 @@ import sys
 import os
 # Temporary change to force redeploy
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from fastapi import FastAPI, UploadFile, File
+import json
+import shutil
+import threading
+import time
+from typing import List, Optional, Union
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from app.services import ingest, summarize, query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, StrictInt, StrictStr, field_validator
+from app.services import jobs, lexical, llm_gateway, metrics, store, summarize, query, workspaces
 
 import os
 
@@ -18,25 +26,176 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = "data/input_images"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Paths of the default workspace; other workspaces live under WORKSPACE_ROOT
+_default_paths = workspaces.workspace_paths(workspaces.DEFAULT_WORKSPACE, create=True)
+UPLOAD_DIR = _default_paths["input_dir"]
+TEXT_DIR = _default_paths["text_dir"]
+PERSIST_DIR = _default_paths["persist_dir"]
 
-@app.post("/upload")
-async def upload(file: UploadFile = File(...)):
-    filepath = os.path.join(UPLOAD_DIR, file.filename)
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# OCR, chunking and embedding run in background worker processes fed by a job queue
+
+# Set WARMUP_ON_STARTUP=1 to load the models in the background at startup
+# instead of on the first question
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "0") == "1"
+
+# Set TRACE_REQUESTS=1 to log the timing spans of every request as one JSON line
+TRACE_REQUESTS = os.environ.get("TRACE_REQUESTS", "0") == "1"
+
+metrics.describe("rag_http_request_duration_seconds", "HTTP request latency by route")
+metrics.register_collector(jobs.collect_metrics)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    with metrics.trace() as spans:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+
+    # Label by route template, not raw path, to keep the number of series bounded
+    route = request.scope.get("route")
+    path = getattr(route, "path", "unmatched")
+    metrics.observe("rag_http_request_duration_seconds", elapsed,
+                    method=request.method, route=path, status=response.status_code)
+    if TRACE_REQUESTS and path != "/metrics":
+        # Streaming responses are logged once headers are sent, before the body finishes
+        print(json.dumps({"trace": path, "method": request.method, "status": response.status_code,
+                          "ms": round(elapsed * 1000, 2), "spans": spans}))
+    return response
+
+@app.exception_handler(llm_gateway.LLMOverloaded)
+async def llm_overloaded(request: Request, exc: llm_gateway.LLMOverloaded):
+    # Too many LLM calls queued: ask the client to retry instead of piling up
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(llm_gateway.RETRY_AFTER_SECONDS)})
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+def start_ingest_workers():
+    jobs.start_workers()
+
+@app.on_event("startup")
+def start_warmup():
+    if not WARMUP_ON_STARTUP:
+        return
+
+    def warmup():
+        try:
+            query.warmup(PERSIST_DIR)
+        except Exception as e:
+            print(f"⚠️ Warmup failed: {e}")
+
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_ingest_workers():
+    jobs.stop_workers()
+
+def resolve_workspace(name, create=False):
+    """Paths of a workspace, or a 400 error for an invalid name"""
+    try:
+        return workspaces.workspace_paths(name, create=create)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def save_upload(file, filepath):
     with open(filepath, "wb") as f:
-        f.write(await file.read())
-    text = ingest.extract_text_from_file(filepath)
-    with open(f"data/text_outputs/{file.filename}.txt", "w", encoding="utf-8") as f:
-        f.write(text)
-    return {"message": "File uploaded and text extracted"}
+        shutil.copyfileobj(file, f, UPLOAD_CHUNK_SIZE)
+
+@app.get("/workspaces")
+def list_workspaces():
+    return {"workspaces": workspaces.list_workspaces()}
+
+@app.post("/upload")
+async def upload(file: UploadFile = File(...), workspace: str = workspaces.DEFAULT_WORKSPACE):
+    paths = resolve_workspace(workspace, create=True)
+    if store.is_snapshot(paths["persist_dir"]):
+        raise HTTPException(status_code=409, detail="This workspace is served from a read-only index snapshot")
+    filepath = os.path.join(paths["input_dir"], os.path.basename(file.filename))
+    await run_in_threadpool(save_upload, file.file, filepath)
+
+    job_id = await run_in_threadpool(jobs.enqueue, paths["input_dir"], paths["text_dir"], paths["persist_dir"])
+    return {"message": "File uploaded, ingest queued", "job_id": job_id}
+
+@app.get("/jobs")
+def list_jobs(limit: int = 50, workspace: str = None):
+    persist_dir = resolve_workspace(workspace)["persist_dir"] if workspace else None
+    return {"jobs": jobs.list_jobs(limit, persist_dir=persist_dir), "queue_depth": jobs.queue_depth()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 @app.get("/theme")
-def get_theme():
-    return {"summary": summarize.summarize_theme()}
+def get_theme(workspace: str = workspaces.DEFAULT_WORKSPACE):
+    return {"summary": summarize.summarize_theme(resolve_workspace(workspace)["text_dir"])}
+
+class QueryOptions(BaseModel):
+    workspace: Optional[str] = None
+    where: Optional[dict] = None
+    sections: Optional[Union[StrictStr, List[StrictStr]]] = None
+    rerank: Optional[bool] = None
+
+    @field_validator("where")
+    @classmethod
+    def check_where(cls, where):
+        if where is not None:
+            lexical.validate_where(where)
+        return where
+
+    def filter(self):
+        return self.where or query.section_filter(self.sections)
+
+class Question(QueryOptions):
+    question: StrictStr = ""
+
+class BatchQuestions(QueryOptions):
+    questions: List[StrictStr] = []
+    sources: Optional[List[StrictStr]] = None
+    concurrency: Optional[StrictInt] = Field(None, ge=1)
 
 @app.post("/question")
-def ask_question(payload: dict):
-    question = payload.get("question", "")
-    answer = query.ask_question(question)
+async def ask_question(payload: Question):
+    persist_dir = resolve_workspace(payload.workspace)["persist_dir"]
+    answer = await query.aask_question(payload.question, persist_dir, rerank=payload.rerank, where=payload.filter())
     return {"answer": answer}
+
+@app.post("/questions/batch")
+async def ask_questions_batch(payload: BatchQuestions):
+    # Newline-delimited JSON: one result per (question, source) as it finishes, then a "done" line
+    persist_dir = resolve_workspace(payload.workspace)["persist_dir"]
+    where = payload.filter()
+    concurrency = min(payload.concurrency or query.BATCH_CONCURRENCY, query.BATCH_CONCURRENCY)
+
+    async def lines():
+        async for event in query.astream_questions_batch(
+            payload.questions, payload.sources, persist_dir,
+            rerank=payload.rerank, where=where, concurrency=concurrency
+        ):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+@app.post("/question/stream")
+async def ask_question_stream(payload: Question):
+    # Server-sent events: retrieved sources first, then answer tokens
+    persist_dir = resolve_workspace(payload.workspace)["persist_dir"]
+    where = payload.filter()
+
+    async def events():
+        async for event in query.astream_answer(payload.question, persist_dir, rerank=payload.rerank, where=where):
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
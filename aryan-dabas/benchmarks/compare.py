@@ -0,0 +1,47 @@
+"""
+Compare two benchmark result files from benchmarks/pipeline.py.
+
+Run from the project root, for example:
+    python benchmarks/compare.py data/benchmarks/results/pipeline-abc1234-*.json data/benchmarks/results/pipeline-def5678-*.json
+"""
+
+import argparse
+import json
+
+# Metrics compared for each stage; for *_per_sec higher is better, otherwise lower
+METRICS = ("docs_per_sec", "chunks_per_sec", "seconds", "p50_ms", "p95_ms", "p99_ms")
+
+
+def load_runs(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return report, {run["docs"]: run["stages"] for run in report["runs"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    base_report, base_runs = load_runs(args.baseline)
+    new_report, new_runs = load_runs(args.candidate)
+    print(f"🧪 {base_report.get('commit')} -> {new_report.get('commit')}")
+
+    for docs in sorted(set(base_runs) & set(new_runs)):
+        print(f"\n📄 {docs} documents")
+        for stage, before in base_runs[docs].items():
+            after = new_runs[docs].get(stage)
+            if not after:
+                continue
+            for metric in METRICS:
+                if metric not in before or metric not in after or not before[metric]:
+                    continue
+                ratio = after[metric] / before[metric]
+                better = ratio > 1 if metric.endswith("_per_sec") else ratio < 1
+                marker = "➖" if abs(ratio - 1) < 0.05 else ("✅" if better else "⚠️")
+                print(f"  {marker} {stage:14} {metric:15} {before[metric]:>10} -> {after[metric]:>10} ({ratio:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
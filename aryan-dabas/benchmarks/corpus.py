@@ -0,0 +1,141 @@
+"""
+Synthetic document corpus for the pipeline benchmarks.
+
+Generates resume-like PDFs and images with a fixed seed, together with a
+``corpus.json`` holding the ground-truth text of every file. Re-running with
+the same settings reuses the existing corpus.
+
+Run from the project root, for example:
+    python benchmarks/corpus.py --docs 100 --out data/benchmarks/corpus-100
+"""
+
+import argparse
+import json
+import os
+import random
+import textwrap
+
+SKILLS = (
+    "python java kubernetes docker aws azure gcp terraform sql postgresql pandas numpy "
+    "tensorflow pytorch spark kafka react typescript golang rust linux git airflow tableau "
+    "excel leadership communication negotiation mentoring scrum agile"
+).split()
+
+WORDS = (
+    "project managed team developed designed client sales research university intern "
+    "experience skills education certification analysis system database model pipeline "
+    "delivered improved reduced launched migrated automated built led supported customers "
+    "platform service reporting quarterly revenue latency costs data product roadmap"
+).split()
+
+ROLES = ["Software Engineer", "Data Scientist", "Product Manager", "DevOps Engineer", "Analyst"]
+
+CORPUS_VERSION = 1
+
+
+def make_document(rng, index, paragraphs):
+    """One resume-like document as plain text"""
+    skills = rng.sample(SKILLS, 6)
+    lines = [
+        f"Candidate {index:05d}",
+        f"{rng.choice(ROLES)} with {rng.randint(1, 15)} years of experience",
+        "",
+        "Skills: " + ", ".join(skills),
+        "",
+    ]
+    for _ in range(paragraphs):
+        words = [rng.choice(WORDS + skills) for _ in range(rng.randint(40, 90))]
+        lines.append(" ".join(words).capitalize() + ".")
+        lines.append("")
+    return "\n".join(lines).strip() + "\n"
+
+
+def write_pdf(path, text, chars_per_page=1800):
+    import fitz  # PyMuPDF
+
+    with fitz.open() as doc:
+        for start in range(0, len(text), chars_per_page):
+            page = doc.new_page()
+            page.insert_textbox(fitz.Rect(50, 50, 560, 800), text[start:start + chars_per_page], fontsize=10)
+        doc.save(path)
+
+
+def write_image(path, text, width=1240):
+    from PIL import Image, ImageDraw, ImageFont
+
+    lines = []
+    for paragraph in text.split("\n"):
+        lines.extend(textwrap.wrap(paragraph, 90) or [""])
+    try:
+        font = ImageFont.load_default(size=20)
+    except TypeError:
+        font = ImageFont.load_default()
+    image = Image.new("RGB", (width, 60 + 28 * len(lines)), color="white")
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((40, 30 + 28 * i), line, fill="black", font=font)
+    image.save(path)
+
+
+def generate(out_dir, docs=100, image_ratio=0.2, paragraphs=6, seed=0):
+    """Write the corpus to ``out_dir`` and return ``{filename: text}``"""
+    settings = {"version": CORPUS_VERSION, "docs": docs, "image_ratio": image_ratio,
+                "paragraphs": paragraphs, "seed": seed}
+    manifest_file = os.path.join(out_dir, "corpus.json")
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing.get("settings") == settings:
+            print(f"✓ Reusing corpus in {out_dir}")
+            return existing["texts"]
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    texts = {}
+    print(f"🔄 Generating {docs} documents in {out_dir}...")
+    for i in range(docs):
+        text = make_document(rng, i, paragraphs)
+        if rng.random() < image_ratio:
+            filename = f"doc-{i:05d}.png"
+            write_image(os.path.join(out_dir, filename), text)
+        else:
+            filename = f"doc-{i:05d}.pdf"
+            write_pdf(os.path.join(out_dir, filename), text)
+        texts[filename] = text
+
+    with open(manifest_file, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "texts": texts}, f)
+    return texts
+
+
+def make_queries(count, seed=1):
+    """Questions that mention skills present in the corpus"""
+    rng = random.Random(seed)
+    templates = [
+        "Which candidates know {} and {}?",
+        "Who has experience with {}?",
+        "List the skills of candidates who used {} and {}.",
+    ]
+    queries = []
+    for _ in range(count):
+        template = rng.choice(templates)
+        queries.append(template.format(*rng.sample(SKILLS, template.count("{}"))))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--image-ratio", type=float, default=0.2)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="defaults to data/benchmarks/corpus-<docs>")
+    args = parser.parse_args()
+
+    out_dir = args.out or os.path.join("data", "benchmarks", f"corpus-{args.docs}")
+    texts = generate(out_dir, args.docs, args.image_ratio, args.paragraphs, args.seed)
+    print(f"✅ {len(texts)} documents in {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Embedding throughput benchmark (chunks/sec) for the BGE embedding backends.
+
+Run from the project root, for example:
+    python benchmarks/embedding_throughput.py --backend torch onnx onnx-int8 --batch-size 32 64
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from backend.app.services import chunking, embed, embedder
+
+WORDS = (
+    "python java kubernetes docker aws leadership communication sql pandas tensorflow "
+    "project managed team developed designed client sales research university intern "
+    "experience skills education certification analysis system database model"
+).split()
+
+
+def load_chunks(text_dir, count):
+    """Chunk the extracted text outputs, padding with synthetic chunks up to ``count``"""
+    splitter = embed.get_text_splitter()
+    chunks = [c.page_content for c in chunking.split_documents(embed.load_texts(text_dir), splitter)]
+    rng = random.Random(0)
+    while len(chunks) < count:
+        length = rng.randint(20, 90)
+        chunks.append(" ".join(rng.choice(WORDS) for _ in range(length)))
+    return chunks[:count]
+
+
+def run(backend, batch_size, threads, chunks, reference=None):
+    model = embedder.BGEEmbeddings(backend=backend, batch_size=batch_size, num_threads=threads)
+    model.embed_documents(chunks[:batch_size])  # warm up
+
+    started = time.perf_counter()
+    vectors = model.embed_documents(chunks)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "backend": backend,
+        "batch_size": batch_size,
+        "threads": threads,
+        "chunks": len(chunks),
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(len(chunks) / elapsed, 1),
+    }
+    if reference is not None:
+        # Vectors are normalized, so the row-wise dot product is the cosine similarity
+        cosine = np.sum(np.asarray(vectors) * np.asarray(reference), axis=1)
+        result["min_cosine_vs_torch"] = round(float(cosine.min()), 4)
+    return result, vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", nargs="+", default=["torch"], choices=embedder.BACKENDS)
+    parser.add_argument("--batch-size", nargs="+", type=int, default=[64])
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0 = library default)")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--text-dir", default="data/text_outputs")
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.text_dir, args.chunks)
+    reference = None
+    print(f"🧪 Embedding {len(chunks)} chunks")
+
+    for backend in args.backend:
+        for batch_size in args.batch_size:
+            result, vectors = run(backend, batch_size, args.threads, chunks, reference)
+            if backend == "torch" and reference is None:
+                reference = vectors
+            print(result)
+
+
+if __name__ == "__main__":
+    main()
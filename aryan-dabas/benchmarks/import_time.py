@@ -0,0 +1,66 @@
+"""
+Import and first-use latency benchmark for the backend services.
+
+Each module is imported in a fresh interpreter so earlier imports do not hide
+its cost. With --first-use the embedding model and LLM client are also
+created, which is what the first question pays for.
+
+Run from the project root, for example:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --first-use
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["embed", "ingest", "jobs", "query", "summarize", "store"]
+
+SNIPPET = """
+import json, sys, time
+started = time.perf_counter()
+import importlib
+module = importlib.import_module("backend.app.services." + sys.argv[1])
+result = {"module": sys.argv[1], "import_sec": round(time.perf_counter() - started, 3)}
+heavy = ("torch", "sentence_transformers", "langchain_chroma", "chromadb", "langchain_ollama", "fitz", "pytesseract")
+result["heavy_modules_loaded"] = sorted(name for name in heavy if name in sys.modules)
+if sys.argv[2] == "1":
+    from backend.app.services import query, store
+    started = time.perf_counter()
+    store.get_embeddings().embed_query("warmup")
+    result["embeddings_sec"] = round(time.perf_counter() - started, 3)
+    started = time.perf_counter()
+    query.get_chain()
+    result["llm_client_sec"] = round(time.perf_counter() - started, 3)
+print(json.dumps(result))
+"""
+
+
+def measure(module, first_use):
+    completed = subprocess.run(
+        [sys.executable, "-c", SNIPPET, module, "1" if first_use else "0"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        return {"module": module, "error": completed.stderr.strip().splitlines()[-1:]}
+    # Modules may print status lines; the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", nargs="+", default=MODULES, choices=MODULES)
+    parser.add_argument("--first-use", action="store_true", help="also time loading the embedding model and LLM client")
+    args = parser.parse_args()
+
+    print(f"🧪 Timing imports in fresh interpreters ({sys.executable})")
+    for module in args.module:
+        print(measure(module, args.first_use))
+
+
+if __name__ == "__main__":
+    main()
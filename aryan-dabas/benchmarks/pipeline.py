@@ -0,0 +1,326 @@
+"""
+End-to-end pipeline benchmark on a synthetic corpus.
+
+Times each stage separately and writes the results to JSON so runs can be
+compared between commits (see benchmarks/compare.py):
+
+    extract_pdf      ingest.extract_text_from_pdf, per document
+    extract_image    ingest.extract_text_from_image, per document
+    ingest           ingest.process_files over the whole corpus (worker pool)
+    chunking         page/section-aware splitting of the ground-truth texts
+    embedding        embedding model throughput (no embedding cache)
+    chroma_insert    adding precomputed vectors to a fresh Chroma collection
+    bm25_build       building and saving the lexical index
+    search           similarity_search latency percentiles
+    retrieve         hybrid retrieval latency percentiles
+    ask_question     end-to-end answers with a local stub LLM instead of Ollama
+    ask_rerank       the same with cross-encoder reranking (rerank latency reported separately)
+    ask_batch        query.ask_questions_batch over questions x documents vs. a serial ask_question loop
+    snapshot         export to a memory-mapped snapshot, open time and search latency on it,
+                     plus BM25 latency and per-process heap of bm25.json vs. the mmapped postings
+
+Stages after extraction use the generator's ground-truth texts, so they do
+not depend on OCR quality. Extraction is timed on at most --extract-sample
+documents of each type.
+
+Run from the project root, for example:
+    python benchmarks/pipeline.py --docs 10 100 1000
+    python benchmarks/pipeline.py --docs 10000 --skip ingest extract_image
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# Measure the model, not the on-disk embedding cache
+os.environ.setdefault("EMBED_CACHE", "0")
+
+import numpy as np
+
+import corpus
+from backend.app.services import chunking, embed, ingest, lexical, metrics, query, snapshot, store
+
+STAGES = ["extract_pdf", "extract_image", "ingest", "chunking", "embedding", "chroma_insert",
+          "bm25_build", "search", "retrieve", "ask_question", "ask_rerank", "ask_batch", "snapshot"]
+
+STUB_ANSWER = "Python, SQL, Docker, Kubernetes, communication"
+
+
+def latency_stats(seconds):
+    """Summary statistics of a list of per-call latencies, in milliseconds"""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000
+    return {
+        "count": len(ms),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def timed_calls(fn, items):
+    results, seconds = [], []
+    for item in items:
+        started = time.perf_counter()
+        results.append(fn(item))
+        seconds.append(time.perf_counter() - started)
+    return results, seconds
+
+
+def use_stub_llm():
+    """Answer with a fixed local LLM so ask_question runs without Ollama"""
+    from langchain_core.language_models.fake import FakeListLLM
+
+    query._llm = FakeListLLM(responses=[STUB_ANSWER])
+    query._chain = None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(docs, args, work_dir):
+    """Run every selected stage on a corpus of ``docs`` documents"""
+    from langchain_core.documents import Document
+
+    corpus_dir = os.path.join(args.corpus_root, f"corpus-{docs}")
+    texts = corpus.generate(corpus_dir, docs, args.image_ratio, args.paragraphs)
+    files = sorted(texts)
+    pdfs = [os.path.join(corpus_dir, f) for f in files if f.endswith(".pdf")]
+    images = [os.path.join(corpus_dir, f) for f in files if not f.endswith(".pdf")]
+    queries = corpus.make_queries(args.queries)
+    selected = [stage for stage in STAGES if stage not in args.skip]
+    result = {"docs": docs, "pdfs": len(pdfs), "images": len(images), "stages": {}}
+    stages = result["stages"]
+
+    def stage(name, fn):
+        if name not in selected:
+            return None
+        print(f"⏱️ [{docs} docs] {name}...")
+        try:
+            stages[name] = fn()
+        except Exception as e:
+            print(f"❌ {name} failed: {e}")
+            stages[name] = {"error": str(e)}
+        return stages[name]
+
+    def extract(fn, paths):
+        paths = paths[:args.extract_sample]
+        if not paths:
+            return {"count": 0}
+        outputs, seconds = timed_calls(fn, paths)
+        return dict(latency_stats(seconds), docs_per_sec=round(len(paths) / sum(seconds), 2),
+                    chars=sum(len(text) for text in outputs))
+
+    stage("extract_pdf", lambda: extract(ingest.extract_text_from_pdf, pdfs))
+    stage("extract_image", lambda: extract(ingest.extract_text_from_image, images))
+
+    def run_ingest():
+        output_dir = os.path.join(work_dir, "text_outputs")
+        started = time.perf_counter()
+        report = ingest.process_files(corpus_dir, output_dir, workers=args.workers)
+        elapsed = time.perf_counter() - started
+        return {"seconds": round(elapsed, 3), "docs_per_sec": round(docs / elapsed, 2),
+                "workers": args.workers or ingest.default_workers(),
+                "processed": len(report["processed"]), "failed": len(report["failed"])}
+
+    stage("ingest", run_ingest)
+
+    documents = [Document(page_content=texts[f], metadata={"source": f}) for f in files]
+    splitter = embed.get_text_splitter()
+    started = time.perf_counter()
+    chunks = chunking.split_documents(documents, splitter)
+    chunk_seconds = time.perf_counter() - started
+    ids = [f"{chunk.metadata['source']}::{i}" for i, chunk in enumerate(chunks)]
+    chunk_texts = [chunk.page_content for chunk in chunks]
+    stage("chunking", lambda: {"seconds": round(chunk_seconds, 3), "chunks": len(chunks),
+                               "chunks_per_sec": round(len(chunks) / chunk_seconds, 1)})
+
+    vectors = None
+    if any(name in selected for name in STAGES[4:]):
+        model = store.get_embeddings()
+        model = getattr(model, "base", model)
+        model.embed_documents(chunk_texts[:model.batch_size])  # warm up
+        started = time.perf_counter()
+        vectors = model.embed_documents(chunk_texts)
+        embed_seconds = time.perf_counter() - started
+        stage("embedding", lambda: {"seconds": round(embed_seconds, 3), "backend": model.backend,
+                                    "batch_size": model.batch_size,
+                                    "chunks_per_sec": round(len(chunk_texts) / embed_seconds, 1)})
+
+    if vectors is None:
+        return result
+
+    persist_dir = os.path.join(work_dir, "chroma_store")
+
+    def chroma_insert():
+        db = store.get_vectorstore(persist_dir)
+        started = time.perf_counter()
+        for i in range(0, len(ids), embed.ADD_BATCH_SIZE):
+            db._collection.add(
+                ids=ids[i:i + embed.ADD_BATCH_SIZE],
+                embeddings=vectors[i:i + embed.ADD_BATCH_SIZE],
+                documents=chunk_texts[i:i + embed.ADD_BATCH_SIZE],
+                metadatas=[chunk.metadata for chunk in chunks[i:i + embed.ADD_BATCH_SIZE]],
+            )
+        elapsed = time.perf_counter() - started
+        return {"seconds": round(elapsed, 3), "chunks_per_sec": round(len(ids) / elapsed, 1),
+                "batch_size": embed.ADD_BATCH_SIZE}
+
+    def bm25_build():
+        started = time.perf_counter()
+        bm25 = lexical.BM25Index()
+        for chunk_id, chunk in zip(ids, chunks):
+            bm25.add(chunk_id, chunk.page_content, chunk.metadata)
+        lexical.save_index(bm25, persist_dir)
+        return {"seconds": round(time.perf_counter() - started, 3), "chunks": len(bm25)}
+
+    if stage("chroma_insert", chroma_insert) is None or "error" in stages["chroma_insert"]:
+        return result
+    stage("bm25_build", bm25_build)
+
+    def search():
+        db = store.get_vectorstore(persist_dir)
+        db.similarity_search(queries[0], k=query.DENSE_K)  # warm up
+        _, seconds = timed_calls(lambda q: db.similarity_search(q, k=query.DENSE_K), queries)
+        return dict(latency_stats(seconds), k=query.DENSE_K)
+
+    def retrieve():
+        _, seconds = timed_calls(lambda q: query.retrieve(q, persist_dir, k=query.HYBRID_K), queries)
+        return dict(latency_stats(seconds), k=query.HYBRID_K)
+
+    def ask(rerank=False):
+        use_stub_llm()
+        seconds, prompt_tokens, rerank_seconds = [], [], []
+        for q in queries:
+            with metrics.trace() as spans:
+                started = time.perf_counter()
+                query.ask_question(q, persist_dir, use_cache=False, rerank=rerank)
+                seconds.append(time.perf_counter() - started)
+            prompt_tokens += [s["prompt_tokens"] for s in spans if s["span"] == "query.context"]
+            rerank_seconds += [s["ms"] / 1000 for s in spans if s["span"] == "query.rerank"]
+        result = dict(latency_stats(seconds), llm="stub")
+        if prompt_tokens:
+            result["prompt_tokens_mean"] = round(sum(prompt_tokens) / len(prompt_tokens), 1)
+        if rerank_seconds:
+            result["rerank"] = latency_stats(rerank_seconds)
+        return result
+
+    def ask_batch():
+        use_stub_llm()
+        questions = queries[:args.batch_questions]
+        sources = files[:args.batch_sources]
+        started = time.perf_counter()
+        for source in sources:
+            for q in questions:
+                query.ask_question(q, persist_dir, use_cache=False, where=query.source_filter(source))
+        serial = time.perf_counter() - started
+        started = time.perf_counter()
+        results = query.ask_questions_batch(questions, sources, persist_dir, use_cache=False)
+        batch = time.perf_counter() - started
+        return {"pairs": len(results), "serial_seconds": round(serial, 3), "batch_seconds": round(batch, 3),
+                "speedup": round(serial / batch, 2), "concurrency": query.BATCH_CONCURRENCY, "llm": "stub"}
+
+    stage("search", search)
+    stage("retrieve", retrieve)
+    stage("ask_question", ask)
+    stage("ask_rerank", lambda: ask(rerank=True))
+    stage("ask_batch", ask_batch)
+
+    def snapshot_stage():
+        snapshot_dir = os.path.join(work_dir, "snapshot")
+        started = time.perf_counter()
+        info = snapshot.export_snapshot(persist_dir, snapshot_dir)
+        export_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        index = snapshot.SnapshotIndex(snapshot_dir)
+        open_seconds = time.perf_counter() - started
+        embeddings = store.get_embeddings().embed_documents(queries)
+        index.search(embeddings[0], query.DENSE_K)  # warm up the page cache
+        _, seconds = timed_calls(lambda e: index.search(e, query.DENSE_K), embeddings)
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, f)) for f in os.listdir(snapshot_dir))
+        result = dict(latency_stats(seconds), k=query.DENSE_K, rows=info["rows"],
+                      export_seconds=round(export_seconds, 3), open_ms=round(open_seconds * 1000, 2),
+                      size_mb=round(size / 1e6, 2))
+        if index.bm25 is not None:
+            # Per-process Python heap of the lexical index: parsed JSON vs. memory-mapped arrays
+            tracemalloc.start()
+            lexical.load_index(persist_dir)
+            json_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            tracemalloc.start()
+            snapshot.SnapshotIndex(snapshot_dir)
+            mmap_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            _, seconds = timed_calls(lambda q: index.bm25.search(q, k=query.FUSION_CANDIDATES), queries)
+            result["bm25"] = dict(latency_stats(seconds), heap_mb_json=round(json_bytes / 1e6, 2),
+                                  heap_mb_snapshot=round(mmap_bytes / 1e6, 2))
+        return result
+
+    stage("snapshot", snapshot_stage)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", nargs="+", type=int, default=[10, 100])
+    parser.add_argument("--image-ratio", type=float, default=0.2)
+    parser.add_argument("--paragraphs", type=int, default=6)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-questions", type=int, default=10, help="questions per document in ask_batch")
+    parser.add_argument("--batch-sources", type=int, default=20, help="documents screened in ask_batch")
+    parser.add_argument("--extract-sample", type=int, default=50, help="max documents of each type timed for extraction")
+    parser.add_argument("--workers", type=int, default=None, help="ingest worker processes (default: INGEST_WORKERS)")
+    parser.add_argument("--skip", nargs="*", default=[], choices=STAGES)
+    parser.add_argument("--corpus-root", default=os.path.join("data", "benchmarks"))
+    parser.add_argument("--output", default=None, help="defaults to data/benchmarks/results/pipeline-<commit>-<time>.json")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    report = {
+        "benchmark": "pipeline",
+        "commit": commit,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {key: os.environ.get(key) for key in
+                     ("EMBED_BACKEND", "EMBED_BATCH_SIZE", "EMBED_THREADS", "EMBED_CACHE", "INGEST_WORKERS")},
+        "args": vars(args),
+        "runs": [],
+    }
+
+    for docs in args.docs:
+        work_dir = os.path.join(args.corpus_root, "work", f"run-{docs}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        try:
+            report["runs"].append(run(docs, args, work_dir))
+        finally:
+            store.invalidate(os.path.join(work_dir, "chroma_store"), reset=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(args.corpus_root, "results", f"pipeline-{commit or 'nogit'}-{timestamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
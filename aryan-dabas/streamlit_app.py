@@ -1,23 +1,25 @@
 import streamlit as st
 from streamlit import markdown
+import hashlib
 import os
+import time
 import warnings
 
 # Suppress warnings for cleaner output
 warnings.filterwarnings("ignore")
 
 # Fix for PyTorch/Streamlit compatibility issue
-try:
-    import torch
-    torch.set_num_threads(1)
-    # Set environment variable to avoid the torch.classes issue
-    os.environ["TORCH_COMPILE_DISABLE"] = "1"
-except ImportError:
-    pass
+# (embedding threads are set with EMBED_THREADS, see backend/app/services/embedder.py)
+# torch itself is only imported when the embedding model is first loaded;
+# set the environment variable up front to avoid the torch.classes issue
+os.environ["TORCH_COMPILE_DISABLE"] = "1"
+
+# Stop following an ingest job that has not finished after this many seconds
+INGEST_WAIT_TIMEOUT = float(os.environ.get("INGEST_WAIT_TIMEOUT", "1800"))
 
 # Import your services
 try:
-    from backend.app.services import ingest, embed, query, summarize
+    from backend.app.services import chunking, embed, jobs, query, store, summarize, workspaces
 except ImportError as e:
     st.error(f"❌ Import error: {e}")
     st.error("Please make sure all dependencies are installed correctly.")
@@ -36,6 +38,45 @@ if "history" not in st.session_state:
 if "vectorstore_ready" not in st.session_state:
     st.session_state.vectorstore_ready = False
 
+if "job_id" not in st.session_state:
+    st.session_state.job_id = None
+
+if "upload_key" not in st.session_state:
+    st.session_state.upload_key = None
+
+if "workspace" not in st.session_state:
+    st.session_state.workspace = workspaces.DEFAULT_WORKSPACE
+
+# Streamlit reruns this script on every interaction, so anything expensive is
+# cached: resources once per server process, data by its inputs.
+
+@st.cache_resource(show_spinner=False)
+def start_workers():
+    """Background ingest workers, started once per server process"""
+    jobs.start_workers()
+    return True
+
+@st.cache_resource(show_spinner="🔄 Loading models...")
+def load_pipeline():
+    """Load the embedding model, vector store and LLM client once per server process"""
+    query.warmup(workspaces.workspace_paths()["persist_dir"])
+    return True
+
+def enqueue_upload(workspace, files):
+    """Save an upload set and queue its ingest job (deduplicated per session by ``upload_key``)"""
+    paths = workspaces.workspace_paths(workspace, create=True)
+    for file in files:
+        with open(os.path.join(paths["input_dir"], file.name), "wb") as f:
+            f.write(file.getvalue())
+    return jobs.enqueue(paths["input_dir"], paths["text_dir"], paths["persist_dir"])
+
+@st.cache_data(show_spinner=False)
+def load_documents(text_dir, index_version):
+    """Extracted documents, reloaded only when the index changes"""
+    return embed.load_texts(text_dir)
+
+start_workers()
+
 # Page configuration
 st.set_page_config(
     page_title="Document Research Assistant",
@@ -46,6 +87,36 @@ st.set_page_config(
 st.title("🧠 Document Research Assistant")
 st.markdown("Upload documents and ask questions about their content!")
 
+# Each workspace has its own documents and index
+workspace_input = st.sidebar.text_input("🗂️ Workspace", value=st.session_state.workspace,
+                                        help="Existing: " + ", ".join(workspaces.list_workspaces()))
+try:
+    workspace = workspaces.validate_name(workspace_input)
+except ValueError as e:
+    st.sidebar.error(f"❌ {e}")
+    workspace = st.session_state.workspace
+
+if workspace != st.session_state.workspace:
+    st.session_state.workspace = workspace
+    st.session_state.docs = None
+    st.session_state.theme = None
+    st.session_state.history = []
+    st.session_state.vectorstore_ready = False
+    st.session_state.job_id = None
+    st.session_state.upload_key = None
+
+paths = workspaces.workspace_paths(workspace)
+
+# Open a workspace that was indexed before without uploading again
+if not st.session_state.vectorstore_ready and st.session_state.job_id is None:
+    version = store.index_version(paths["persist_dir"])
+    if version is not None:
+        docs = load_documents(paths["text_dir"], version)
+        if docs:
+            st.session_state.docs = docs
+            st.session_state.theme = summarize.get_cached_theme(docs)
+            st.session_state.vectorstore_ready = True
+
 # File upload section
 uploaded_files = st.file_uploader(
     "Upload image(s) or PDF(s)",
@@ -54,47 +125,69 @@ uploaded_files = st.file_uploader(
 )
 
 if uploaded_files:
-    try:
-        # Create directories
-        os.makedirs("data/input_images", exist_ok=True)
-        os.makedirs("data/text_outputs", exist_ok=True)
-        
-        # Save uploaded files
-        for file in uploaded_files:
-            file_path = os.path.join("data/input_images", file.name)
-            with open(file_path, "wb") as f:
-                f.write(file.getvalue())
-
-        st.success("✅ Files uploaded successfully.")
-        
-        # Process files
-        with st.spinner("🔍 Extracting text from documents..."):
-            ingest.process_files("data/input_images", "data/text_outputs")
-        st.success("✅ Text extraction completed!")
-
-        # Load and embed documents
-        with st.spinner("📚 Loading and embedding documents..."):
-            docs = embed.load_texts("data/text_outputs")
-            if docs:
-                vectorstore = embed.embed_documents(docs)
-                if vectorstore:
-                    st.session_state.docs = docs
-                    st.session_state.vectorstore_ready = True
-                    st.success("✅ Documents embedded successfully!")
-                else:
-                    st.error("❌ Failed to create embeddings")
-            else:
-                st.error("❌ No text extracted from documents")
+    # Only queue work when the set of uploaded files changes, not on every rerun
+    upload_key = tuple(sorted((file.name, hashlib.sha256(file.getvalue()).hexdigest()) for file in uploaded_files))
+    if upload_key != st.session_state.upload_key:
+        try:
+            st.session_state.job_id = enqueue_upload(workspace, uploaded_files)
+            st.session_state.upload_key = upload_key
+            st.session_state.vectorstore_ready = False
+            st.success("✅ Files uploaded successfully. Processing queued.")
 
-    except Exception as e:
-        st.error(f"❌ Error processing files: {str(e)}")
+        except Exception as e:
+            st.error(f"❌ Error processing files: {str(e)}")
+
+# Follow the ingest job until the worker finishes it
+if st.session_state.job_id and not st.session_state.vectorstore_ready:
+    job = jobs.get_job(st.session_state.job_id)
+    progress_bar = st.progress(0.0)
+    status = st.empty()
+    deadline = time.monotonic() + INGEST_WAIT_TIMEOUT
+    while job and job["status"] in ("queued", "running") and time.monotonic() < deadline:
+        progress_bar.progress(min(job["progress"], 1.0))
+        status.info(f"⏳ {job['status'].capitalize()}: {job['stage'] or 'waiting for a worker'}...")
+        # A worker killed mid-job (crash, OOM) never updates it again
+        if not jobs.fail_orphan(job["id"]):
+            time.sleep(0.5)
+        job = jobs.get_job(st.session_state.job_id)
+    progress_bar.empty()
+    status.empty()
+
+    if job and job["status"] == "done":
+        result = job["result"] or {}
+        timings = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in job["timings"].items())
+        st.success(
+            f"✅ Text extraction completed! {len(result.get('processed', []))} new, "
+            f"{len(result.get('skipped', []))} unchanged ({timings})."
+        )
+        if result.get("failed"):
+            st.warning(f"⚠️ No text extracted from: {', '.join(result['failed'])}")
+
+        docs = load_documents(paths["text_dir"], store.index_version(paths["persist_dir"]))
+        if docs:
+            load_pipeline()
+            st.session_state.docs = docs
+            # Show a stored theme for these documents right away, without calling the LLM
+            st.session_state.theme = summarize.get_cached_theme(docs)
+            st.session_state.vectorstore_ready = True
+            st.success("✅ Documents embedded successfully!")
+        else:
+            st.error("❌ No text extracted from documents")
+    else:
+        if job and job["status"] in ("queued", "running"):
+            st.error(f"❌ Ingest job is still {job['status']} after {INGEST_WAIT_TIMEOUT:g}s; check the worker log")
+        else:
+            st.error(f"❌ Error processing files: {job['error'] if job else 'job not found'}")
+        st.session_state.job_id = None
+        # Let the same files be queued again on the next rerun
+        st.session_state.upload_key = None
 
 # Theme summarization section
 if st.session_state.docs and st.button("🔎 Summarize Theme"):
     try:
         with st.spinner("📝 Generating theme summary..."):
-            full_text = "\n".join([doc.page_content for doc in st.session_state.docs])
-            summary = summarize.get_theme_summary(full_text)
+            # Summarize each document, then combine the summaries into one theme
+            summary = summarize.summarize_corpus(st.session_state.docs)
             st.session_state.theme = summary
         st.success("✅ Theme extracted!")
     except Exception as e:
@@ -112,6 +205,7 @@ if st.session_state.vectorstore_ready:
     # Q&A Section
     st.markdown("### 💬 Ask a Question")
     query_text = st.text_input("🔍 Type your question about the documents")
+    sections = st.multiselect("📑 Only search these sections (optional)", list(chunking.SECTION_HEADINGS))
 
     col1, col2 = st.columns([1, 2])
     with col1:
@@ -122,8 +216,29 @@ if st.session_state.vectorstore_ready:
     # Process question
     if ask_clicked and query_text.strip():
         try:
-            with st.spinner("🤖 Searching for answer..."):
-                answer = query.ask_question(query_text)
+            status = st.empty()
+            sources_box = st.empty()
+            answer_box = st.empty()
+            status.info("🤖 Searching for answer...")
+
+            # Render sources and tokens as they arrive instead of waiting for the full answer
+            answer = ""
+            for event in query.stream_answer(query_text, paths["persist_dir"], where=query.section_filter(sections)):
+                if event["type"] == "sources":
+                    status.info("✍️ Generating answer...")
+                    names = sorted({s["source"] for s in event["sources"] if s["source"]})
+                    sources_box.caption("📚 Sources: " + ", ".join(names))
+                elif event["type"] == "token":
+                    answer += event["text"]
+                    answer_box.markdown(answer + "▌")
+                elif event["type"] == "done":
+                    answer = event["answer"]
+                elif event["type"] in ("error", "overloaded"):
+                    answer = event["message"]
+
+            status.empty()
+            sources_box.empty()
+            answer_box.empty()
             st.session_state.history.append((query_text, answer))
             st.success("✅ Answer generated!")
         except Exception as e: